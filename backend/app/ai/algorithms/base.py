@@ -1,55 +1,79 @@
 import math
 from abc import ABC, abstractmethod
 from ..heuristics import Heuristics
+from ..tables import load_tables, compact_list
 
 # --- LOOKUP TABLES ---
 _TABLES_INIT = False
 _ROW_LEFT_TABLE = [0] * 65536
 _ROW_RIGHT_TABLE = [0] * 65536
 _SCORE_TABLE = [0] * 65536
+# Bảng cột: input là 1 hàng của board đã transpose (= 1 cột của board gốc),
+# output là cột kết quả đã trải ra 64-bit (nibble i ở bit 16*i), chỉ cần dịch 4*c
+# để đặt vào cột c -> UP/DOWN không phải transpose ngược lại.
+_COL_UP_TABLE = [0] * 65536
+_COL_DOWN_TABLE = [0] * 65536
 
 def _init_tables():
+    """Nạp bảng từ cache (mmap, xem app/ai/tables.py) vào các list tra cứu nhanh"""
     global _TABLES_INIT
 
-    for row in range(65536):
-        line = [(row >> (i * 4)) & 0xF for i in range(4)]
-
-        def sim_move(l):
-            res = []
-            sc = 0
-            non_zero = [x for x in l if x != 0]
-            skip = False
-            for i in range(len(non_zero)):
-                if skip: skip = False; continue
-                if i < len(non_zero) - 1 and non_zero[i] == non_zero[i+1]:
-                    new_val = non_zero[i] + 1
-                    res.append(new_val)
-                    sc += (1 << new_val)
-                    skip = True
-                else:
-                    res.append(non_zero[i])
-            while len(res) < 4: res.append(0)
-            return res, sc
-
-        # Tính toán Move Left
-        new_line_l, score_l = sim_move(line)
-        _ROW_LEFT_TABLE[row] = (new_line_l[0] | (new_line_l[1] << 4) | 
-                                (new_line_l[2] << 8) | (new_line_l[3] << 12))
-        _SCORE_TABLE[row] = score_l
-
-        # Tính toán Move Right (Reverse -> Move Left -> Reverse)
-        new_line_r, _ = sim_move(line[::-1]) # Reverse input
-        new_line_r = new_line_r[::-1]       # Reverse output
-        _ROW_RIGHT_TABLE[row] = (new_line_r[0] | (new_line_r[1] << 4) | 
-                                 (new_line_r[2] << 8) | (new_line_r[3] << 12))
-    
+    t = load_tables()
+    _ROW_LEFT_TABLE[:] = compact_list(t['row_left'])
+    _ROW_RIGHT_TABLE[:] = compact_list(t['row_right'])
+    _SCORE_TABLE[:] = compact_list(t['score'])
+    _COL_UP_TABLE[:] = compact_list(t['col_up'])
+    _COL_DOWN_TABLE[:] = compact_list(t['col_down'])
+
     _TABLES_INIT = True
 
 
+# --- Ô TRỐNG BẰNG PHÉP BIT ---
+# empty_bits(board): bit 4*i bật nếu ô i trống. Bit thấp nhất còn lại (bits & -bits)
+# chính là tile 2 (rank 1) đặt vào ô đó, nên chance node chỉ cần board | bit / bit << 1.
+# Vòng lặp nóng (chance node, rollout) viết inline 3 dòng của empty_bits để khỏi tốn lời gọi hàm.
+_NIBBLE_LOW = 0x1111111111111111
+
+def empty_bits(board):
+    x = board | (board >> 2)
+    x |= x >> 1
+    return (x & _NIBBLE_LOW) ^ _NIBBLE_LOW
+
+# Đếm bit bật (int.bit_count, nhanh hơn bin(x).count("1"))
+popcount = int.bit_count
+
+def count_empty(board):
+    """Số ô trống (đếm bit của empty_bits)"""
+    return empty_bits(board).bit_count()
+
+def nth_bit(bits, k):
+    """Bit bật thứ k (đếm từ bit thấp, k bắt đầu từ 0)"""
+    for _ in range(k):
+        bits &= bits - 1
+    return bits & -bits
+
+def spawn_tile(board, rng):
+    """
+    Sinh 1 tile ngẫu nhiên (90% ra 2, 10% ra 4) vào ô trống, dùng rng (random / Random).
+    Trả về (board mới, True) hoặc (board, False) nếu hết ô trống.
+    Cùng chuỗi số ngẫu nhiên với cách cũ choice(list ô trống) + random().
+    """
+    bits = empty_bits(board)
+    if not bits:
+        return board, False
+    bit = nth_bit(bits, rng.randrange(bits.bit_count()))
+    return board | (bit if rng.random() < 0.9 else bit << 1), True
+
+
 class BaseSolver(ABC):
-    def __init__(self, depth=3, weights=None):
+    def __init__(self, depth=3, weights=None, eval_cache=None):
         self.depth = depth
-        self.evaluator = Heuristics(weights)
+        # Độ sâu thực tế đã tìm (khác self.depth khi solver tự chọn độ sâu)
+        self.depth_reached = depth
+        # eval_cache: bật cache kết quả get_score (True hoặc số entry, xem Heuristics)
+        self.evaluator = Heuristics(weights, cache=eval_cache)
+        # Bộ đếm cache lúc bắt đầu lần tìm gần nhất (cache dùng chung theo bộ trọng số)
+        self._eval_cache_start = None
         
         if (not _TABLES_INIT):
             _init_tables()
@@ -58,6 +82,17 @@ class BaseSolver(ABC):
     def get_best_move(self, grid):
         pass
 
+    def _start_eval_cache_stats(self):
+        """Gọi đầu get_best_move: eval_cache_stats() chỉ tính lần tìm này"""
+        if self.evaluator.cache is not None:
+            self._eval_cache_start = self.evaluator.cache.counters()
+
+    def eval_cache_stats(self):
+        """Thống kê cache get_score của lần tìm gần nhất (None nếu không bật cache)"""
+        if self.evaluator.cache is None:
+            return None
+        return self.evaluator.cache.stats(since=self._eval_cache_start)
+
     def simulate_move(self, board, direction):
         # 1. Chuyển Grid -> Bitboard
         old_board = board
@@ -69,21 +104,60 @@ class BaseSolver(ABC):
         elif direction == 1: # RIGHT
             board, score = self._lut_move_right(board)
         elif direction == 2: # UP
-            # Up = Transpose -> Move Left -> Transpose
-            t = self._transpose(board)
-            t, score = self._lut_move_left(t)
-            board = self._transpose(t)
+            board, score = self._lut_move_up(board)
         elif direction == 3: # DOWN
-            # Down = Transpose -> Move Right -> Transpose
-            t = self._transpose(board)
-            t, score = self._lut_move_right(t)
-            board = self._transpose(t)
+            board, score = self._lut_move_down(board)
 
         # 3. Kiểm tra thay đổi
         changed = (board != old_board)
 
         return board, score, changed
 
+    def expand(self, board):
+        """
+        Tất cả nước đi hợp lệ của board trong 1 lần gọi: list (direction, child, merge_score)
+        theo thứ tự LEFT, RIGHT, UP, DOWN. Tách hàng 1 lần cho LEFT/RIGHT,
+        transpose 1 lần cho UP/DOWN (bảng cột).
+        """
+        children = []
+        r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+        merge = _SCORE_TABLE[r0] + _SCORE_TABLE[r1] + _SCORE_TABLE[r2] + _SCORE_TABLE[r3]
+        nb = (_ROW_LEFT_TABLE[r0] | (_ROW_LEFT_TABLE[r1]<<16) | (_ROW_LEFT_TABLE[r2]<<32) | (_ROW_LEFT_TABLE[r3]<<48))
+        if nb != board: children.append((0, nb, merge))
+        nb = (_ROW_RIGHT_TABLE[r0] | (_ROW_RIGHT_TABLE[r1]<<16) | (_ROW_RIGHT_TABLE[r2]<<32) | (_ROW_RIGHT_TABLE[r3]<<48))
+        if nb != board: children.append((1, nb, merge))
+
+        t = self._transpose(board)
+        c0 = t & 0xFFFF; c1 = (t >> 16) & 0xFFFF; c2 = (t >> 32) & 0xFFFF; c3 = (t >> 48) & 0xFFFF
+        merge = _SCORE_TABLE[c0] + _SCORE_TABLE[c1] + _SCORE_TABLE[c2] + _SCORE_TABLE[c3]
+        nb = (_COL_UP_TABLE[c0] | (_COL_UP_TABLE[c1]<<4) | (_COL_UP_TABLE[c2]<<8) | (_COL_UP_TABLE[c3]<<12))
+        if nb != board: children.append((2, nb, merge))
+        nb = (_COL_DOWN_TABLE[c0] | (_COL_DOWN_TABLE[c1]<<4) | (_COL_DOWN_TABLE[c2]<<8) | (_COL_DOWN_TABLE[c3]<<12))
+        if nb != board: children.append((3, nb, merge))
+        return children
+
+    def expand_into(self, board, moves, boards, scores):
+        """
+        Giống expand() nhưng ghi vào 3 list có sẵn (dài ít nhất 4) thay vì tạo tuple,
+        trả về số nước hợp lệ n (dữ liệu nằm ở index 0..n-1).
+        """
+        n = 0
+        r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+        merge = _SCORE_TABLE[r0] + _SCORE_TABLE[r1] + _SCORE_TABLE[r2] + _SCORE_TABLE[r3]
+        nb = (_ROW_LEFT_TABLE[r0] | (_ROW_LEFT_TABLE[r1]<<16) | (_ROW_LEFT_TABLE[r2]<<32) | (_ROW_LEFT_TABLE[r3]<<48))
+        if nb != board: moves[n] = 0; boards[n] = nb; scores[n] = merge; n += 1
+        nb = (_ROW_RIGHT_TABLE[r0] | (_ROW_RIGHT_TABLE[r1]<<16) | (_ROW_RIGHT_TABLE[r2]<<32) | (_ROW_RIGHT_TABLE[r3]<<48))
+        if nb != board: moves[n] = 1; boards[n] = nb; scores[n] = merge; n += 1
+
+        t = self._transpose(board)
+        c0 = t & 0xFFFF; c1 = (t >> 16) & 0xFFFF; c2 = (t >> 32) & 0xFFFF; c3 = (t >> 48) & 0xFFFF
+        merge = _SCORE_TABLE[c0] + _SCORE_TABLE[c1] + _SCORE_TABLE[c2] + _SCORE_TABLE[c3]
+        nb = (_COL_UP_TABLE[c0] | (_COL_UP_TABLE[c1]<<4) | (_COL_UP_TABLE[c2]<<8) | (_COL_UP_TABLE[c3]<<12))
+        if nb != board: moves[n] = 2; boards[n] = nb; scores[n] = merge; n += 1
+        nb = (_COL_DOWN_TABLE[c0] | (_COL_DOWN_TABLE[c1]<<4) | (_COL_DOWN_TABLE[c2]<<8) | (_COL_DOWN_TABLE[c3]<<12))
+        if nb != board: moves[n] = 3; boards[n] = nb; scores[n] = merge; n += 1
+        return n
+
     # --- BITBOARD HELPERS ---
 
     def grid_to_bitboard(self, grid):
@@ -150,6 +224,51 @@ class BaseSolver(ABC):
         )
         return new_board, score
 
+    def _lut_move_up(self, board):
+        # Transpose 1 lần để lấy cột, bảng cột trả thẳng về vị trí trên board gốc
+        t = self._transpose(board)
+        c0 = t & 0xFFFF
+        c1 = (t >> 16) & 0xFFFF
+        c2 = (t >> 32) & 0xFFFF
+        c3 = (t >> 48) & 0xFFFF
+
+        new_board = (
+            _COL_UP_TABLE[c0] |
+            (_COL_UP_TABLE[c1] << 4) |
+            (_COL_UP_TABLE[c2] << 8) |
+            (_COL_UP_TABLE[c3] << 12)
+        )
+
+        score = (
+            _SCORE_TABLE[c0] +
+            _SCORE_TABLE[c1] +
+            _SCORE_TABLE[c2] +
+            _SCORE_TABLE[c3]
+        )
+        return new_board, score
+
+    def _lut_move_down(self, board):
+        t = self._transpose(board)
+        c0 = t & 0xFFFF
+        c1 = (t >> 16) & 0xFFFF
+        c2 = (t >> 32) & 0xFFFF
+        c3 = (t >> 48) & 0xFFFF
+
+        new_board = (
+            _COL_DOWN_TABLE[c0] |
+            (_COL_DOWN_TABLE[c1] << 4) |
+            (_COL_DOWN_TABLE[c2] << 8) |
+            (_COL_DOWN_TABLE[c3] << 12)
+        )
+
+        score = (
+            _SCORE_TABLE[c0] +
+            _SCORE_TABLE[c1] +
+            _SCORE_TABLE[c2] +
+            _SCORE_TABLE[c3]
+        )
+        return new_board, score
+
     def _transpose(self, x):
         a1 = x & 0xF0F00F0FF0F00F0F;
         a2 = x & 0x0000F0F00000F0F0;
@@ -0,0 +1,107 @@
+import sys
+import numpy as np
+from ..tables import load_tables
+
+# Engine di chuyển theo lô: cùng logic với BaseSolver.simulate_move nhưng làm việc
+# trên mảng NumPy uint64 (mỗi phần tử là 1 bitboard), dùng bản NumPy của các bảng hàng.
+
+# Bảng NumPy (tạo lười từ bảng dùng chung trong app/ai/tables.py)
+_NP_TABLES = None
+
+# Trên máy little-endian, view uint16 của 1 board cho đúng 4 hàng theo thứ tự r0..r3
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+_U16 = np.uint64(0xFFFF)
+_SHIFTS_16 = [np.uint64(16 * i) for i in range(4)]
+
+
+def _np_tables():
+    global _NP_TABLES
+    if _NP_TABLES is None:
+        t = load_tables()
+        # uint16: chỉ khác bảng gốc khi gộp 2 ô 32768 (bản scalar cũng tràn sang hàng kế bên)
+        _NP_TABLES = (t['row_left'].astype(np.uint16),
+                      t['row_right'].astype(np.uint16),
+                      t['score'].astype(np.int64))
+    return _NP_TABLES
+
+
+def transpose_batch(x):
+    a1 = x & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = x & np.uint64(0x0000F0F00000F0F0)
+    a3 = x & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def _rows(boards):
+    """Mảng (N, 4) các hàng 16-bit của boards"""
+    if _LITTLE_ENDIAN:
+        return boards.view(np.uint16).reshape(-1, 4)
+    return np.stack([(boards >> sh) & _U16 for sh in _SHIFTS_16], axis=1).astype(np.uint16)
+
+
+def _join(rows):
+    """Ngược lại của _rows: (N, 4) uint16 -> (N,) uint64"""
+    if _LITTLE_ENDIAN:
+        return np.ascontiguousarray(rows).view(np.uint64).reshape(-1)
+    out = np.zeros(rows.shape[0], dtype=np.uint64)
+    for i, sh in enumerate(_SHIFTS_16):
+        out |= rows[:, i].astype(np.uint64) << sh
+    return out
+
+
+def _lut_batch(boards, table, score_table):
+    rows = _rows(boards)
+    return _join(table[rows]), score_table[rows].sum(axis=1)
+
+
+def move_batch(boards, direction):
+    """
+    Di chuyển cả mảng board theo 1 hướng (0 LEFT, 1 RIGHT, 2 UP, 3 DOWN).
+    Trả về (board mới, điểm gộp, mask thay đổi) - mỗi thứ là mảng dài N.
+    """
+    left_t, right_t, score_t = _np_tables()
+    boards = np.ascontiguousarray(boards, dtype=np.uint64).reshape(-1)
+
+    if direction == 0:
+        new, score = _lut_batch(boards, left_t, score_t)
+    elif direction == 1:
+        new, score = _lut_batch(boards, right_t, score_t)
+    elif direction == 2:
+        t, score = _lut_batch(transpose_batch(boards), left_t, score_t)
+        new = transpose_batch(t)
+    elif direction == 3:
+        t, score = _lut_batch(transpose_batch(boards), right_t, score_t)
+        new = transpose_batch(t)
+    else:
+        raise ValueError(f"Unknown direction: {direction}")
+
+    return new, score, new != boards
+
+
+def move_batch_all(boards):
+    """
+    Cả 4 hướng một lần: trả về mảng (N, 4) board mới, điểm gộp và mask thay đổi.
+    LEFT/RIGHT dùng chung việc tách hàng, UP/DOWN dùng chung 1 lần transpose.
+    """
+    left_t, right_t, score_t = _np_tables()
+    boards = np.ascontiguousarray(boards, dtype=np.uint64).reshape(-1)
+
+    rows = _rows(boards)
+    row_score = score_t[rows].sum(axis=1)
+    cols = _rows(transpose_batch(boards))
+    col_score = score_t[cols].sum(axis=1)
+
+    nexts = np.stack([
+        _join(left_t[rows]),
+        _join(right_t[rows]),
+        transpose_batch(_join(left_t[cols])),
+        transpose_batch(_join(right_t[cols])),
+    ], axis=1)
+    scores = np.stack([row_score, row_score, col_score, col_score], axis=1)
+
+    return nexts, scores, nexts != boards[:, None]
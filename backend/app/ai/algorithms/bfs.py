@@ -29,21 +29,17 @@ class BFSSolver(BaseSolver):
                 continue
 
             # Mở rộng trạng thái (Branching)
-            is_leaf = True
-            for direction in range(4):
-                # simulate_move đã hỗ trợ bitboard, trả về (new_board, score, moved)
-                new_board, move_score, moved = self.simulate_move(c_board, direction)
-                
-                if moved:
-                    is_leaf = False
-                    # Xác định nhánh khởi đầu (nếu chưa có)
-                    next_first_move = f_move if f_move != -1 else direction
-                    
-                    # Đẩy vào queue
-                    # Lưu ý: BFS này bỏ qua bước sinh Random Tile (Enemy Turn) 
-                    # để tránh bùng nổ tổ hợp (Branching factor quá lớn), 
-                    # nên nó hoạt động như một thuật toán Greedy Lookahead.
-                    queue.append((new_board, next_first_move, depth + 1, acc_score + move_score))
+            children = self.expand(c_board)
+            is_leaf = not children
+            for direction, new_board, move_score in children:
+                # Xác định nhánh khởi đầu (nếu chưa có)
+                next_first_move = f_move if f_move != -1 else direction
+
+                # Đẩy vào queue
+                # Lưu ý: BFS này bỏ qua bước sinh Random Tile (Enemy Turn) 
+                # để tránh bùng nổ tổ hợp (Branching factor quá lớn), 
+                # nên nó hoạt động như một thuật toán Greedy Lookahead.
+                queue.append((new_board, next_first_move, depth + 1, acc_score + move_score))
 
             # Xử lý trường hợp là lá (Game Over hoặc kẹt) trước khi hết depth
             if is_leaf and f_move != -1:
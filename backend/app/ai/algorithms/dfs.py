@@ -14,19 +14,11 @@ class DFSSolver(BaseSolver):
 
         best_score = -float('inf')
         best_move = -1
-        has_valid_move = False
 
-        # Thử 4 hướng di chuyển
-        for direction in range(4):
-            # simulate_move trong BaseSolver đã hỗ trợ Bitboard
-            # Trả về: (new_board_int, score_gained, is_moved)
-            new_board, score_gained, moved = self.simulate_move(board, direction)
-            
-            if not moved: 
-                continue
-
-            has_valid_move = True
+        # Các hướng đi hợp lệ: (direction, new_board_int, score_gained)
+        children = self.expand(board)
 
+        for direction, new_board, score_gained in children:
             # --- LOGIC DFS (Greedy Lookahead) ---
             # DFS cho 2048 thường bỏ qua bước Chance (sinh số ngẫu nhiên) 
             # để có thể duyệt rất sâu (Depth 10-20) mà không bị bùng nổ tổ hợp.
@@ -44,7 +36,7 @@ class DFSSolver(BaseSolver):
                 best_move = direction
 
         # Nếu tại node này không đi được hướng nào (Game Over hoặc Kẹt)
-        if not has_valid_move:
+        if not children:
             return self.evaluator.get_score(board), -1
 
         return best_score, best_move
\ No newline at end of file
@@ -1,15 +1,177 @@
+import math
+import multiprocessing
 import random
-from .base import BaseSolver, _ROW_LEFT_TABLE, _ROW_RIGHT_TABLE, _SCORE_TABLE
+import time
+from .base import BaseSolver, _ROW_LEFT_TABLE, _ROW_RIGHT_TABLE, _COL_UP_TABLE, _COL_DOWN_TABLE
+from .base import _NIBBLE_LOW, empty_bits, count_empty, nth_bit
+from .symmetry import canonical, TO_CANONICAL, FROM_CANONICAL
+from .transposition import TranspositionTable, SharedTranspositionTable, get_shared_table, prob_band, DEFAULT_TT_MB
+from .transposition import get_shared_memory_table
 
 # Ngưỡng cắt nhánh: 0.0001 (0.01%)
 CUTOFF_THRESHOLD = 0.0001
 
-_EMPTY_TABLE = [[] for _ in range(65536)]
-for r in range(65536):
-    line = [(r >> (i*4)) & 0xF for i in range(4)]
-    _EMPTY_TABLE[r] = [i for i, val in enumerate(line) if val == 0]
+# Iterative deepening: độ sâu tối đa và chu kỳ kiểm tra đồng hồ (số node)
+MAX_ITERATIVE_DEPTH = 12
+TIME_CHECK_INTERVAL = 256
+
+# Adaptive depth: giới hạn mặc định khi solver tự chọn độ sâu theo độ phức tạp bàn cờ
+ADAPTIVE_MIN_DEPTH = 2
+ADAPTIVE_EXTRA_DEPTH = 2   # max_depth mặc định = depth + ADAPTIVE_EXTRA_DEPTH
+
+# Tìm kiếm song song: dưới độ sâu này task (Max node ở depth - 2) quá nhỏ so với chi phí IPC
+PARALLEL_MIN_DEPTH = 4
+
+class _SearchTimeout(Exception):
+    """Hết thời gian cho phép giữa chừng một vòng lặp iterative deepening"""
+    pass
+
+def _parallel_task(args):
+    """
+    Task của tìm kiếm song song (chạy trong worker): 1 Max node ngay dưới lớp Chance đầu tiên.
+    tt_table là bảng chuyển vị trong shared memory của process cha (mọi worker dùng chung).
+    Trả về kèm bộ đếm bảng tăng thêm trong task (None nếu không dùng bảng).
+    """
+    index, board, depth, prob, weights, tt_table, engine = args
+    before = tt_table.counters() if tt_table is not None else None
+    solver = ExpectimaxSolver(depth, weights, use_tt=tt_table is not None, tt_table=tt_table, engine=engine)
+    value, _ = solver._search(board, depth, True, prob)
+    counters = tt_table.counters_since(before) if tt_table is not None else None
+    return index, value, solver.nodes, counters
+
+def _new_stack(levels):
+    """Buffer cho expectimax_stack: 15 list theo tầng + board/nước đi của tối đa 4 con mỗi tầng"""
+    return tuple([0] * levels for _ in range(15)) + ([0] * (4 * levels), [0] * (4 * levels))
+
+def count_distinct_tiles(board):
+    """Số loại tile khác nhau (bỏ ô trống): gom rank vào 1 bitmask rồi đếm bit"""
+    ranks = 0
+    while board:
+        ranks |= 1 << (board & 0xF)
+        board >>= 4
+    return bin(ranks >> 1).count("1")
 
 class ExpectimaxSolver(BaseSolver):
+    def __init__(self, depth=3, weights=None, use_tt=True, tt_mb=DEFAULT_TT_MB, shared_tt=False,
+                 time_budget_ms=None, depth_policy="fixed", min_depth=None, max_depth=None,
+                 chance_samples=None, chance_sampling="random", seed=None, pruning=None,
+                 symmetry=False, engine="recursive", parallel=False, tt_table=None,
+                 eval_cache=None):
+        super().__init__(depth, weights, eval_cache)
+        self.weights = weights
+        self.tt_mb = tt_mb
+        # time_budget_ms: bật chế độ anytime (đào sâu dần tới khi hết giờ), bỏ qua self.depth
+        self.time_budget_ms = time_budget_ms
+
+        # depth_policy: "fixed" (luôn dùng self.depth) hoặc "adaptive" (chọn theo bàn cờ)
+        if depth_policy not in ("fixed", "adaptive"):
+            raise ValueError(f"Unknown depth_policy: {depth_policy}")
+        self.depth_policy = depth_policy
+        self.min_depth = min_depth if min_depth is not None else ADAPTIVE_MIN_DEPTH
+        self.max_depth = max_depth if max_depth is not None else depth + ADAPTIVE_EXTRA_DEPTH
+
+        # Lấy mẫu ở Chance node: chance_samples=k -> chỉ xét k ô khi có nhiều hơn k ô trống
+        #   "random"    : k ô ngẫu nhiên (không lặp)
+        #   "stratified": chia các ô trống (theo thứ tự index) thành k nhóm, mỗi nhóm lấy 1 ô
+        # seed cố định -> cùng bàn cờ luôn ra cùng quyết định
+        if chance_sampling not in ("random", "stratified"):
+            raise ValueError(f"Unknown chance_sampling: {chance_sampling}")
+        if chance_samples is not None and chance_samples < 1:
+            raise ValueError("chance_samples must be >= 1")
+        self.chance_samples = chance_samples
+        self.chance_sampling = chance_sampling
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.sampled_nodes = 0
+        self.sampling_variance = 0.0
+        self.sampling_rel_error = 0.0
+
+        # Pruning: None hoặc "star1"
+        # Dùng cận [L, U] của hàm đánh giá (Heuristics.value_bounds) để Chance node dừng sớm
+        # khi các con còn lại không thể làm đổi quyết định của Max node cha.
+        if pruning not in (None, "star1"):
+            raise ValueError(f"Unknown pruning: {pruning}")
+        if pruning is not None and chance_samples is not None:
+            raise ValueError("pruning cannot be combined with chance_samples")
+        self.pruning = pruning
+        self.cutoffs = 0
+        self._bounds_cache = {}
+        # Cận trên của các Chance node đã fail-low (bảng chuyển vị chỉ giữ giá trị chính xác)
+        self._upper_bounds = {}
+        self.nodes = 0
+        self._deadline = None
+
+        # symmetry=True: bảng chuyển vị dùng board chuẩn (1 trong 8 phép xoay/lật) làm key,
+        # ở root các nước dẫn tới board đối xứng nhau chỉ tìm 1 lần.
+        # Chỉ đúng khi hàm đánh giá đối xứng (weights['snake'] = 0).
+        if symmetry and not self.evaluator.is_symmetric():
+            raise ValueError("symmetry requires a symmetric evaluator (weights['snake'] = 0)")
+        self.symmetry = symmetry
+        self.root_duplicates = 0
+
+        # engine: "recursive" (expectimax) hoặc "stack" (expectimax_stack - cùng kết quả,
+        # không đệ quy). Chỉ áp dụng cho Expectimax đầy đủ; Star1 và lấy mẫu dùng đệ quy.
+        if engine not in ("recursive", "stack"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if engine == "stack" and chance_samples is not None:
+            raise ValueError("engine='stack' cannot be combined with chance_samples")
+        self.engine = engine
+        self._search = self.expectimax_stack if engine == "stack" else self.expectimax
+        self._stack = _new_stack(MAX_ITERATIVE_DEPTH + 1)
+
+        # parallel=True: tách cây dưới root (nước đi x ô sinh số) thành task cho pool tiến trình
+        # dùng chung (app/ai/pool.py). Chỉ cho Expectimax đầy đủ ở độ sâu cố định/adaptive.
+        if parallel and (pruning is not None or chance_samples is not None or
+                         time_budget_ms is not None or symmetry):
+            raise ValueError("parallel cannot be combined with pruning, chance_samples, "
+                             "time_budget_ms or symmetry")
+        self.parallel = parallel
+        self.parallel_tasks = 0
+
+        # Bảng chuyển vị: cache cả Max node lẫn Chance node, sống theo solver
+        # (Benchmark/GA dùng 1 solver cho cả ván nên dùng lại được giữa các nước)
+        # shared_tt=True: dùng bảng chung của process (API tạo solver mới mỗi request)
+        # tt_table: bảng có sẵn (vd SharedTranspositionTable dùng chung giữa các process)
+        if not use_tt:
+            self.tt = None
+        elif tt_table is not None:
+            self.tt = tt_table
+        elif shared_tt:
+            self.tt = get_shared_table(self.cache_namespace(), tt_mb)
+        else:
+            self.tt = TranspositionTable(tt_mb)
+        # Bảng đã dùng ở lần tìm gần nhất (root song song: bảng shared memory của các worker)
+        self._search_tt = self.tt
+
+    def cache_namespace(self):
+        """Key của bảng dùng chung: các giá trị chỉ dùng lại được khi cùng thuật toán & trọng số"""
+        return ("Expectimax", self.evaluator.fingerprint(), self.chance_samples, self.chance_sampling,
+                self.symmetry)
+
+    def search_stats(self):
+        """Thống kê của lần tìm kiếm gần nhất"""
+        sampled = self.sampled_nodes
+        stats = {
+            "nodes": self.nodes,
+            "depth": self.depth_reached,
+            "sampled_nodes": sampled,
+            # Phương sai ước lượng trung bình tại các Chance node được lấy mẫu
+            "sampling_variance": (self.sampling_variance / sampled) if sampled else 0.0,
+            # Sai số chuẩn tương đối trung bình (sqrt(var) / |giá trị|)
+            "sampling_rel_error": (self.sampling_rel_error / sampled) if sampled else 0.0,
+            # Số lần Chance node bị cắt bởi Star1
+            "cutoffs": self.cutoffs,
+            # Số nước ở root bỏ qua vì đối xứng với nước đã tìm
+            "root_duplicates": self.root_duplicates,
+            # Số task đã gửi cho pool (parallel=True)
+            "parallel_tasks": self.parallel_tasks,
+        }
+        if self._search_tt is not None:
+            stats["tt"] = self._search_tt.stats()
+        if self.evaluator.cache is not None:
+            stats["eval_cache"] = self.eval_cache_stats()
+        return stats
+
     def get_best_move(self, grid):
         # Chuẩn hóa đầu vào (Bitboard vs Grid)
         if isinstance(grid, int):
@@ -17,10 +179,224 @@ class ExpectimaxSolver(BaseSolver):
         else:
             board = self.grid_to_bitboard(grid)
             
+        self.nodes = 0
+        self.sampled_nodes = 0
+        self.sampling_variance = 0.0
+        self.sampling_rel_error = 0.0
+        self.cutoffs = 0
+        self.root_duplicates = 0
+        self.parallel_tasks = 0
+        self._search_tt = self.tt
+        self._start_eval_cache_stats()
+        self._upper_bounds.clear()
+        if self.seed is not None:
+            self.rng.seed(self.seed)
+
+        if self.time_budget_ms is not None:
+            return self._iterative_deepening(board)
+
+        depth = self.depth
+        if self.depth_policy == "adaptive":
+            depth = self.choose_depth(board)
+        self.depth_reached = depth
+
+        if self.symmetry:
+            return self._symmetric_root(board, depth)
+
+        # Worker của pool (daemon) không tạo được pool con -> tìm tuần tự
+        if self.parallel and depth >= PARALLEL_MIN_DEPTH and not multiprocessing.current_process().daemon:
+            return self._parallel_root(board, depth)
+
+        if self.pruning is not None:
+            return self.star_search(board, depth, True, 1.0, -float('inf'), float('inf'))[1]
+
         # Bắt đầu đệ quy với xác suất ban đầu là 1.0 (100%)
-        return self.expectimax(board, self.depth, True, 1.0)[1]
+        return self._search(board, depth, True, 1.0)[1]
+
+    def _symmetric_root(self, board, depth):
+        """Root khi symmetry=True: các nước dẫn tới board đối xứng nhau có cùng giá trị, chỉ tìm 1 lần"""
+        by_canon = {}
+        best_score = -float('inf')
+        best_move = -1
+        for move, child, _ in self.expand(board):
+            canon = canonical(child)[0]
+            sc = by_canon.get(canon)
+            if sc is None:
+                if self.pruning is not None:
+                    sc, _ = self.star_search(child, depth - 1, False, 1.0, best_score, float('inf'))
+                else:
+                    sc, _ = self._search(child, depth - 1, False, 1.0)
+                by_canon[canon] = sc
+            else:
+                self.root_duplicates += 1
+            if sc > best_score:
+                best_score = sc; best_move = move
+        return best_move
+
+    def _parallel_root(self, board, depth):
+        """
+        Root song song: mỗi (nước đi, ô trống, tile 2/4) là 1 task Max node ở depth - 2.
+        Pool lấy task từ hàng đợi chung (imap_unordered, chunksize=1) nên worker rảnh tự lấy
+        task kế tiếp - cây con lệch nhau vẫn cân tải. Task lớn (nhiều ô trống) đi trước.
+        Kết quả được ghép lại đúng thứ tự cộng của expectimax() nên cùng giá trị và cùng
+        nước đi với bản tuần tự (khi không dùng bảng chuyển vị; có bảng thì giá trị tùy
+        vào việc task nào gặp entry nào trong bảng chung).
+        """
+        # Import lúc dùng: pool -> manager -> expectimax
+        from ..pool import get_search_pool
+
+        children = self.expand(board)
+        self.nodes = 1 + len(children)
+        if not children:
+            return -1
+
+        # Mọi worker dùng chung 1 bảng chuyển vị trong shared memory (theo namespace, sống theo process)
+        tt_table = None
+        if self.tt is not None:
+            tt_table = self.tt if isinstance(self.tt, SharedTranspositionTable) else \
+                get_shared_memory_table(self.cache_namespace(), self.tt_mb)
+
+        # layout: (move, số ô trống, [(index task, hệ số 0.9/0.1), ...], giá trị nếu không có task)
+        # theo đúng thứ tự duyệt của expectimax()
+        tasks = []
+        layout = []
+        for move, child, _ in children:
+            bits = empty_bits(child)
+            count = bits.bit_count()
+            if count == 0:
+                # Không xảy ra sau 1 nước đi hợp lệ, giữ cho đúng với expectimax()
+                layout.append((move, 0, None, self.evaluator.get_score(child)))
+                continue
+            parts = []
+            prob_per_cell = 1.0 / count
+            new_prob_2 = 1.0 * prob_per_cell * 0.9
+            new_prob_4 = 1.0 * prob_per_cell * 0.1
+            while bits:
+                bit = bits & -bits
+                bits ^= bit
+                if new_prob_2 >= CUTOFF_THRESHOLD:
+                    parts.append((len(tasks), 0.9))
+                    tasks.append((len(tasks), child | bit, depth - 2, new_prob_2, self.weights,
+                                  tt_table, self.engine))
+                if new_prob_4 >= CUTOFF_THRESHOLD:
+                    parts.append((len(tasks), 0.1))
+                    tasks.append((len(tasks), child | (bit << 1), depth - 2, new_prob_4, self.weights,
+                                  tt_table, self.engine))
+            layout.append((move, count, parts, None))
+
+        values = [0.0] * len(tasks)
+        order = sorted(tasks, key=lambda t: count_empty(t[1]), reverse=True)
+        for index, value, nodes, counters in get_search_pool().imap_unordered(_parallel_task, order, chunksize=1):
+            values[index] = value
+            self.nodes += nodes
+            if counters is not None:
+                tt_table.add_counters(counters)
+        self.parallel_tasks = len(tasks)
+        self._search_tt = tt_table
+
+        best_score = -float('inf')
+        best_move = -1
+        for move, count, parts, leaf_value in layout:
+            if parts is None:
+                sc = leaf_value
+            else:
+                total_expect = 0
+                for index, factor in parts:
+                    total_expect += values[index] * factor
+                sc = total_expect / count
+            if sc > best_score: best_score = sc; best_move = move
+        return best_move
+
+    def choose_depth(self, board):
+        """
+        Chọn độ sâu theo độ phức tạp bàn cờ:
+        - Nhiều ô trống: chance node nổ (tới 15 ô x 2 giá trị) nhưng bàn còn an toàn -> nông.
+        - Ít ô trống / nhiều loại tile: cây rẻ hơn và là lúc dễ chết nhất -> sâu hơn.
+        """
+        empty = count_empty(board)
+        distinct = count_distinct_tiles(board)
+
+        depth = self.min_depth + max(0, distinct - 4) // 2
+        if empty <= 4: depth += 1
+        if empty <= 1: depth += 1
+        if empty >= 10: depth -= 1
+
+        return max(self.min_depth, min(self.max_depth, depth))
+
+    def _iterative_deepening(self, board):
+        """
+        Chế độ anytime: tìm ở depth 1, 2, 3... tới khi hết time_budget_ms.
+        Trả về nước đi của vòng sâu nhất đã hoàn tất; self.depth_reached ghi lại độ sâu đó.
+        Vòng sau duyệt các nước ở root theo điểm của vòng trước (nước tốt nhất trước),
+        các node bên dưới dùng lại kết quả qua bảng chuyển vị.
+        """
+        start = time.perf_counter()
+        budget = self.time_budget_ms / 1000.0
+        self.depth_reached = 0
+
+        # Các nước hợp lệ ở root: (move, child, merge_score)
+        children = self.expand(board)
+        if not children:
+            return -1
+
+        best_move = children[0][0]
+        last_duration = None
+        growth = None
+
+        try:
+            for depth in range(1, MAX_ITERATIVE_DEPTH + 1):
+                iter_start = time.perf_counter()
+                elapsed = iter_start - start
+
+                # Không bắt đầu vòng mới nếu dự đoán chắc chắn không kịp
+                if last_duration is not None and growth is not None:
+                    if elapsed + last_duration * growth > budget:
+                        break
+                self._deadline = start + budget
+
+                scores = {}
+                by_canon = {}
+                alpha = -float('inf')
+                for move, child, _ in children:
+                    if self.symmetry:
+                        canon = canonical(child)[0]
+                        if canon in by_canon:
+                            self.root_duplicates += 1
+                            scores[move] = by_canon[canon]
+                            continue
+                    if self.pruning is not None:
+                        # Nước kém hơn alpha chỉ trả về cận trên, vẫn đủ để chọn và sắp thứ tự
+                        sc, _ = self.star_search(child, depth - 1, False, 1.0, alpha, float('inf'))
+                        if sc > alpha: alpha = sc
+                    else:
+                        sc, _ = self._search(child, depth - 1, False, 1.0)
+                    scores[move] = sc
+                    if self.symmetry:
+                        by_canon[canon] = sc
+
+                # Vòng này hoàn tất
+                best_move = max(children, key=lambda mc: scores[mc[0]])[0]
+                self.depth_reached = depth
+                children.sort(key=lambda mc: scores[mc[0]], reverse=True)
+
+                duration = time.perf_counter() - iter_start
+                if last_duration:
+                    growth = max(1.0, duration / last_duration)
+                last_duration = max(duration, 1e-6)
+        except _SearchTimeout:
+            pass
+        finally:
+            self._deadline = None
+
+        return best_move
 
     def expectimax(self, board, depth, is_maximizing, cumulative_prob):
+        # 0. Kiểm tra đồng hồ (chỉ khi chạy chế độ anytime)
+        self.nodes += 1
+        if self._deadline is not None and self.nodes % TIME_CHECK_INTERVAL == 0:
+            if time.perf_counter() > self._deadline:
+                raise _SearchTimeout()
+
         # 1. Pruning theo xác suất (Quan trọng)
         # Nếu xác suất xảy ra trường hợp này quá nhỏ, dừng luôn
         if cumulative_prob < CUTOFF_THRESHOLD:
@@ -30,6 +406,20 @@ class ExpectimaxSolver(BaseSolver):
         if depth == 0:
             return self.evaluator.get_score(board), -1
 
+        # 3. Tra bảng chuyển vị (key = board + cờ loại node)
+        # symmetry: key theo board chuẩn, nước đi lưu theo hệ tọa độ của board chuẩn
+        tt = self.tt
+        if tt is not None:
+            if self.symmetry:
+                canon, sym = canonical(board)
+            else:
+                canon = board; sym = 0
+            key = (canon << 1) | (0 if is_maximizing else 1)
+            band = prob_band(cumulative_prob)
+            entry = tt.probe(key, depth, band)
+            if entry is not None:
+                return entry[0], FROM_CANONICAL[sym][entry[3]]
+
         if is_maximizing: # Lượt AI (Max Node)
             best_score = -float('inf')
             best_move = -1
@@ -56,68 +446,480 @@ class ExpectimaxSolver(BaseSolver):
 
             # --- 2: UP ---
             t_r0=tb&0xFFFF; t_r1=(tb>>16)&0xFFFF; t_r2=(tb>>32)&0xFFFF; t_r3=(tb>>48)&0xFFFF
-            ntb = (_ROW_LEFT_TABLE[t_r0] | (_ROW_LEFT_TABLE[t_r1]<<16) | (_ROW_LEFT_TABLE[t_r2]<<32) | (_ROW_LEFT_TABLE[t_r3]<<48))
-            if ntb != tb:
-                a1=ntb&0xF0F00F0FF0F00F0F; a2=ntb&0x0000F0F00000F0F0; a3=ntb&0x0F0F00000F0F0000
-                a=a1|(a2<<12)|(a3>>12)
-                b1=a&0xFF00FF0000FF00FF; b2=a&0x00FF00FF00000000; b3=a&0x00000000FF00FF00
-                final_b=b1|(b2>>24)|(b3<<24)
+            final_b = (_COL_UP_TABLE[t_r0] | (_COL_UP_TABLE[t_r1]<<4) | (_COL_UP_TABLE[t_r2]<<8) | (_COL_UP_TABLE[t_r3]<<12))
+            if final_b != board:
                 
                 sc, _ = self.expectimax(final_b, depth - 1, False, cumulative_prob)
                 if sc > best_score: best_score = sc; best_move = 2
 
             # --- 3: DOWN ---
-            ntb = (_ROW_RIGHT_TABLE[t_r0] | (_ROW_RIGHT_TABLE[t_r1]<<16) | (_ROW_RIGHT_TABLE[t_r2]<<32) | (_ROW_RIGHT_TABLE[t_r3]<<48))
-            if ntb != tb:
-                a1=ntb&0xF0F00F0FF0F00F0F; a2=ntb&0x0000F0F00000F0F0; a3=ntb&0x0F0F00000F0F0000
-                a=a1|(a2<<12)|(a3>>12)
-                b1=a&0xFF00FF0000FF00FF; b2=a&0x00FF00FF00000000; b3=a&0x00000000FF00FF00
-                final_b=b1|(b2>>24)|(b3<<24)
+            final_b = (_COL_DOWN_TABLE[t_r0] | (_COL_DOWN_TABLE[t_r1]<<4) | (_COL_DOWN_TABLE[t_r2]<<8) | (_COL_DOWN_TABLE[t_r3]<<12))
+            if final_b != board:
 
                 sc, _ = self.expectimax(final_b, depth - 1, False, cumulative_prob)
                 if sc > best_score: best_score = sc; best_move = 3
 
             if best_move == -1:
-                return self.evaluator.get_score(board), -1
-            
+                best_score = self.evaluator.get_score(board)
+
+            if tt is not None:
+                tt.store(key, best_score, depth, band, TO_CANONICAL[sym][best_move])
+
             return best_score, best_move
 
         else: # Chance Node (Lượt máy)
-            cells = []
-            for idx in _EMPTY_TABLE[board & 0xFFFF]: cells.append(idx)
-            for idx in _EMPTY_TABLE[(board >> 16) & 0xFFFF]: cells.append(idx + 4)
-            for idx in _EMPTY_TABLE[(board >> 32) & 0xFFFF]: cells.append(idx + 8)
-            for idx in _EMPTY_TABLE[(board >> 48) & 0xFFFF]: cells.append(idx + 12)
-
-            count = len(cells)
+            # bits: bit 4*i bật nếu ô i trống (bit thấp nhất = tile 2 đặt vào ô đó)
+            x = board | (board >> 2)
+            x |= x >> 1
+            bits = (x & _NIBBLE_LOW) ^ _NIBBLE_LOW
+            count = bits.bit_count()
             if count == 0:
-                return self.evaluator.get_score(board), -1
+                value = self.evaluator.get_score(board)
+                if tt is not None:
+                    tt.store(key, value, depth, band)
+                return value, -1
+
+            samples = self.chance_samples
+            if samples is not None and count > samples:
+                value = self._sampled_chance(board, bits, count, samples, depth, cumulative_prob)
+                if tt is not None:
+                    tt.store(key, value, depth, band)
+                return value, -1
 
             total_expect = 0
             
             # Xác suất rơi vào mỗi ô là 1/count
             prob_per_cell = 1.0 / count 
 
-            for idx in cells:
-                shift = idx * 4
-                
-                # --- Trường hợp ra số 2 (Xác suất 0.9) ---
-                # Prob mới = Prob cũ * (1/count) * 0.9
+            if depth == 1:
+                # Các con đều là lá: đánh giá tăng dần, đếm node gộp
                 new_prob_2 = cumulative_prob * prob_per_cell * 0.9
+                new_prob_4 = cumulative_prob * prob_per_cell * 0.1
+                total_expect = self._leaf_chance_total(board, bits, count, new_prob_2, new_prob_4)
+                leaves = 2 * count if new_prob_4 >= CUTOFF_THRESHOLD else count if new_prob_2 >= CUTOFF_THRESHOLD else 0
+                before = self.nodes
+                self.nodes += leaves
+                if self._deadline is not None and before // TIME_CHECK_INTERVAL != self.nodes // TIME_CHECK_INTERVAL:
+                    if time.perf_counter() > self._deadline:
+                        raise _SearchTimeout()
+            else:
+                # Duyệt từng bit bật (ô trống) từ thấp đến cao, không tạo list
+                while bits:
+                    bit = bits & -bits
+                    bits ^= bit
                 
-                # Chỉ gọi đệ quy nếu xác suất này đủ lớn
-                if new_prob_2 >= CUTOFF_THRESHOLD:
-                    val2, _ = self.expectimax(board | (1 << shift), depth - 1, True, new_prob_2)
-                    total_expect += val2 * 0.9
+                    # --- Trường hợp ra số 2 (Xác suất 0.9) ---
+                    # Prob mới = Prob cũ * (1/count) * 0.9
+                    new_prob_2 = cumulative_prob * prob_per_cell * 0.9
                 
-                # --- Trường hợp ra số 4 (Xác suất 0.1) ---
-                # Prob mới = Prob cũ * (1/count) * 0.1
-                new_prob_4 = cumulative_prob * prob_per_cell * 0.1
+                    # Chỉ gọi đệ quy nếu xác suất này đủ lớn
+                    if new_prob_2 >= CUTOFF_THRESHOLD:
+                        val2, _ = self.expectimax(board | bit, depth - 1, True, new_prob_2)
+                        total_expect += val2 * 0.9
                 
-                if new_prob_4 >= CUTOFF_THRESHOLD:
-                    val4, _ = self.expectimax(board | (2 << shift), depth - 1, True, new_prob_4)
-                    total_expect += val4 * 0.1
+                    # --- Trường hợp ra số 4 (Xác suất 0.1) ---
+                    # Prob mới = Prob cũ * (1/count) * 0.1
+                    new_prob_4 = cumulative_prob * prob_per_cell * 0.1
+                
+                    if new_prob_4 >= CUTOFF_THRESHOLD:
+                        val4, _ = self.expectimax(board | (bit << 1), depth - 1, True, new_prob_4)
+                        total_expect += val4 * 0.1
             
             # Chia trung bình cho số ô trống (theo đúng công thức Expectimax)
             # Tổng quát: Sum(Value * Prob) = (Sum(val2*0.9 + val4*0.1)) / count
-            return total_expect / count, -1
\ No newline at end of file
+            value = total_expect / count
+            if tt is not None:
+                tt.store(key, value, depth, band)
+            return value, -1
+
+    def expectimax_stack(self, board, depth, is_maximizing, cumulative_prob):
+        """
+        Cùng phép tìm với expectimax() (cùng thứ tự duyệt, cùng thứ tự cộng, cùng bảng chuyển vị)
+        nhưng không đệ quy: các node đang mở nằm trong các buffer theo tầng (self._stack),
+        bên dưới root chỉ trả về float. Node lá (depth 1 -> 0) được đánh giá ngay trong vòng
+        lặp của node cha, không đẩy vào stack.
+        Trả về (điểm, nước đi) như expectimax(); nước đi chỉ có nghĩa ở root.
+        """
+        evaluate = self.evaluator.get_score
+        leaf_chance_total = self._leaf_chance_total
+        tt = self.tt
+        symmetry = self.symmetry
+        frexp = math.frexp
+        left_t = _ROW_LEFT_TABLE; right_t = _ROW_RIGHT_TABLE
+        up_t = _COL_UP_TABLE; down_t = _COL_DOWN_TABLE
+        cutoff = CUTOFF_THRESHOLD
+
+        # Đồng hồ (chế độ anytime): kiểm tra khi số node vượt qua bội tiếp theo của
+        # TIME_CHECK_INTERVAL (các lá của 1 node được đếm gộp, kiểm tra ở node kế tiếp)
+        nodes = self.nodes
+        deadline = self._deadline
+        if deadline is None:
+            check_at = float('inf')
+        else:
+            check_at = (nodes // TIME_CHECK_INTERVAL + 1) * TIME_CHECK_INTERVAL
+            perf_counter = time.perf_counter
+
+        # Buffer theo tầng (tầng = số frame đang mở), chỉ cấp phát lại khi tìm sâu hơn lần trước
+        if len(self._stack[0]) < depth + 1:
+            self._stack = _new_stack(depth + 1)
+        (f_board, f_depth, f_max, f_cp, f_key, f_band, f_sym, f_next, f_count,
+         f_best, f_move, f_bits, f_total, f_p2, f_p4, c_board, c_move) = self._stack
+
+        # (b, d, mx, cp): node sắp vào (tham số của "lời gọi đệ quy")
+        b = board; d = depth; mx = is_maximizing; cp = cumulative_prob
+        sp = 0
+        root_move = -1
+
+        try:
+            while True:
+                # ===== VÀO NODE (b, d, mx, cp): có giá trị ngay (ret) hoặc mở frame mới =====
+                nodes += 1
+                if nodes >= check_at:
+                    check_at = nodes + TIME_CHECK_INTERVAL
+                    if perf_counter() > deadline:
+                        raise _SearchTimeout()
+
+                if cp < cutoff or d == 0:
+                    ret = evaluate(b)
+                else:
+                    entry = None
+                    if tt is not None:
+                        if symmetry:
+                            canon, sym = canonical(b)
+                        else:
+                            canon = b; sym = 0
+                        key = (canon << 1) | (0 if mx else 1)
+                        band = -frexp(cp)[1]   # = prob_band(cp)
+                        entry = tt.probe(key, d, band)
+
+                    if entry is not None:
+                        ret = entry[0]
+                        if sp == 0:
+                            root_move = FROM_CANONICAL[sym][entry[3]]
+
+                    elif mx:
+                        # --- Max node: sinh cả 4 con vào buffer của tầng sp ---
+                        base = sp * 4
+                        n = 0
+                        r0 = b & 0xFFFF; r1 = (b >> 16) & 0xFFFF; r2 = (b >> 32) & 0xFFFF; r3 = (b >> 48) & 0xFFFF
+                        nb = left_t[r0] | (left_t[r1] << 16) | (left_t[r2] << 32) | (left_t[r3] << 48)
+                        if nb != b: c_board[base] = nb; c_move[base] = 0; n = 1
+                        nb = right_t[r0] | (right_t[r1] << 16) | (right_t[r2] << 32) | (right_t[r3] << 48)
+                        if nb != b: c_board[base + n] = nb; c_move[base + n] = 1; n += 1
+                        a = (b & 0xF0F00F0FF0F00F0F) | ((b & 0x0000F0F00000F0F0) << 12) | ((b & 0x0F0F00000F0F0000) >> 12)
+                        tb = (a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) | ((a & 0x00000000FF00FF00) << 24)
+                        t0 = tb & 0xFFFF; t1 = (tb >> 16) & 0xFFFF; t2 = (tb >> 32) & 0xFFFF; t3 = (tb >> 48) & 0xFFFF
+                        nb = up_t[t0] | (up_t[t1] << 4) | (up_t[t2] << 8) | (up_t[t3] << 12)
+                        if nb != b: c_board[base + n] = nb; c_move[base + n] = 2; n += 1
+                        nb = down_t[t0] | (down_t[t1] << 4) | (down_t[t2] << 8) | (down_t[t3] << 12)
+                        if nb != b: c_board[base + n] = nb; c_move[base + n] = 3; n += 1
+
+                        if n and d > 1:
+                            f_board[sp] = b; f_depth[sp] = d; f_cp[sp] = cp; f_max[sp] = True
+                            if tt is not None:
+                                f_key[sp] = key; f_band[sp] = band; f_sym[sp] = sym
+                            f_next[sp] = 1; f_count[sp] = n
+                            f_best[sp] = -float('inf'); f_move[sp] = -1
+                            sp += 1
+                            b = c_board[base]; d -= 1; mx = False
+                            continue
+
+                        # Con là lá (hoặc không có con): đánh giá ngay
+                        best_score = -float('inf')
+                        best_move = -1
+                        for i in range(base, base + n):
+                            sc = evaluate(c_board[i])
+                            if sc > best_score: best_score = sc; best_move = c_move[i]
+                        nodes += n
+                        if best_move == -1:
+                            best_score = evaluate(b)
+                        if tt is not None:
+                            tt.store(key, best_score, d, band, TO_CANONICAL[sym][best_move])
+                        ret = best_score
+                        if sp == 0:
+                            root_move = best_move
+
+                    else:
+                        # --- Chance node ---
+                        x = b | (b >> 2)
+                        x |= x >> 1
+                        bits = (x & _NIBBLE_LOW) ^ _NIBBLE_LOW
+                        count = bits.bit_count()
+                        if count == 0:
+                            ret = evaluate(b)
+                        else:
+                            prob_per_cell = 1.0 / count
+                            p2 = cp * prob_per_cell * 0.9
+                            p4 = cp * prob_per_cell * 0.1
+                            if p2 >= cutoff and d > 1:
+                                # Mở frame, vào con đầu tiên (ô trống thấp nhất, tile 2)
+                                bit = bits & -bits
+                                f_board[sp] = b; f_depth[sp] = d; f_cp[sp] = cp; f_max[sp] = False
+                                if tt is not None:
+                                    f_key[sp] = key; f_band[sp] = band
+                                f_bits[sp] = bits ^ bit; f_next[sp] = bit; f_move[sp] = 1; f_count[sp] = count
+                                f_total[sp] = 0; f_p2[sp] = p2; f_p4[sp] = p4
+                                sp += 1
+                                b |= bit; d -= 1; mx = True; cp = p2
+                                continue
+
+                            # Con là lá (hoặc dưới ngưỡng): cộng ngay theo đúng thứ tự
+                            total_expect = leaf_chance_total(b, bits, count, p2, p4)
+                            if p4 >= cutoff:
+                                nodes += 2 * count
+                            elif p2 >= cutoff:
+                                nodes += count
+                            ret = total_expect / count
+                        if tt is not None:
+                            tt.store(key, ret, d, band)
+
+                # ===== TRẢ ret VỀ FRAME TRÊN ĐỈNH: đi tiếp con kế hoặc đóng frame =====
+                while sp:
+                    top = sp - 1
+                    if f_max[top]:
+                        i = f_next[top]
+                        if ret > f_best[top]:
+                            f_best[top] = ret; f_move[top] = c_move[top * 4 + i - 1]
+                        if i < f_count[top]:
+                            f_next[top] = i + 1
+                            b = c_board[top * 4 + i]; d = f_depth[top] - 1; mx = False; cp = f_cp[top]
+                            break
+                        # Đóng Max node (có ít nhất 1 con nên best_move != -1)
+                        ret = f_best[top]
+                        if tt is not None:
+                            tt.store(f_key[top], ret, f_depth[top], f_band[top], TO_CANONICAL[f_sym[top]][f_move[top]])
+                        if top == 0:
+                            root_move = f_move[top]
+                    else:
+                        # f_next = bit của ô đang xét, f_move = tile của con vừa xong (1: tile 2, 2: tile 4)
+                        if f_move[top] == 1:
+                            f_total[top] += ret * 0.9
+                            if f_p4[top] >= cutoff:
+                                f_move[top] = 2
+                                b = f_board[top] | (f_next[top] << 1); d = f_depth[top] - 1; mx = True; cp = f_p4[top]
+                                break
+                        else:
+                            f_total[top] += ret * 0.1
+                        bits = f_bits[top]
+                        if bits:
+                            bit = bits & -bits
+                            f_bits[top] = bits ^ bit; f_next[top] = bit; f_move[top] = 1
+                            b = f_board[top] | bit; d = f_depth[top] - 1; mx = True; cp = f_p2[top]
+                            break
+                        # Đóng Chance node
+                        ret = f_total[top] / f_count[top]
+                        if tt is not None:
+                            tt.store(f_key[top], ret, f_depth[top], f_band[top])
+                    sp -= 1
+                else:
+                    return ret, root_move
+        finally:
+            self.nodes = nodes
+
+    def _leaf_chance_total(self, board, bits, count, p2, p4):
+        """
+        Tổng val2 * 0.9 + val4 * 0.1 trên các ô trống (bits) khi mọi con là lá (độ sâu 0),
+        con nào có xác suất dưới CUTOFF_THRESHOLD bị bỏ như khi đệ quy.
+        Sinh tile chỉ đổi 1 hàng + 1 cột nên không dựng từng board con:
+          - đủ cả tile 2 và 4: dạng đóng từ bảng spawn-delta (Heuristics.expected_spawn_total)
+          - chỉ tile 2: đánh giá tăng dần từ đóng góp theo line (Heuristics.spawn_score)
+        """
+        if p4 >= CUTOFF_THRESHOLD:
+            return self.evaluator.expected_spawn_total(board, bits, count)
+        total_expect = 0
+        if p2 < CUTOFF_THRESHOLD:
+            return total_expect
+        contrib = self.evaluator.line_contributions(board)
+        spawn_score = self.evaluator.spawn_score
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            total_expect += spawn_score(contrib, bit.bit_length() >> 2, 1) * 0.9
+        return total_expect
+
+    def _sampled_chance(self, board, bits, count, samples, depth, cumulative_prob):
+        """
+        Chance node chỉ xét `samples` ô trống thay vì tất cả.
+        Giá trị trả về là ước lượng không chệch của trung bình trên mọi ô; phương sai của
+        ước lượng (có hiệu chỉnh quần thể hữu hạn) được cộng dồn vào thống kê.
+        Xác suất truyền xuống con vẫn là xác suất thật (1/count) để CUTOFF_THRESHOLD giữ nguyên ý nghĩa.
+        """
+        rng = self.rng
+
+        # (ô, trọng số) - tổng trọng số = 1
+        if self.chance_sampling == "stratified":
+            picks = []
+            for h in range(samples):
+                lo = h * count // samples
+                hi = (h + 1) * count // samples
+                picks.append((nth_bit(bits, rng.randrange(lo, hi)), (hi - lo) / count))
+        else:
+            weight = 1.0 / samples
+            picks = [(nth_bit(bits, k), weight) for k in rng.sample(range(count), samples)]
+
+        prob_per_cell = 1.0 / count
+        new_prob_2 = cumulative_prob * prob_per_cell * 0.9
+        new_prob_4 = cumulative_prob * prob_per_cell * 0.1
+
+        values = []
+        estimate = 0.0
+        for bit, weight in picks:
+            cell_value = 0.0
+            if new_prob_2 >= CUTOFF_THRESHOLD:
+                val2, _ = self.expectimax(board | bit, depth - 1, True, new_prob_2)
+                cell_value += val2 * 0.9
+            if new_prob_4 >= CUTOFF_THRESHOLD:
+                val4, _ = self.expectimax(board | (bit << 1), depth - 1, True, new_prob_4)
+                cell_value += val4 * 0.1
+            values.append(cell_value)
+            estimate += cell_value * weight
+
+        # Var(mean) ~ (1 - k/n) * s^2 / k (với stratified đây là cận trên)
+        if samples > 1:
+            mean = sum(values) / samples
+            s2 = sum((v - mean) ** 2 for v in values) / (samples - 1)
+            variance = (1.0 - samples / count) * s2 / samples
+        else:
+            variance = 0.0
+
+        self.sampled_nodes += 1
+        self.sampling_variance += variance
+        if estimate:
+            self.sampling_rel_error += (variance ** 0.5) / abs(estimate)
+
+        return estimate
+
+    # --- STAR1 / STAR2 PRUNING ---
+
+    def _chance_bounds(self, board, depth):
+        """Cận giá trị mọi lá bên dưới Chance node: tổng tile chỉ tăng tối đa 4 mỗi lớp Chance"""
+        tile_sum = self.evaluator.tile_sum(board)
+        key = (tile_sum, depth)
+        bounds = self._bounds_cache.get(key)
+        if bounds is None:
+            bounds = self.evaluator.value_bounds(tile_sum, tile_sum + 4 * ((depth + 1) // 2))
+            self._bounds_cache[key] = bounds
+        return bounds
+
+    def _max_children(self, board, first_move=-1):
+        """Các nước hợp lệ (move, board mới, điểm gộp), nước first_move (từ bảng chuyển vị) đứng đầu"""
+        children = self.expand(board)
+
+        if first_move > 0:
+            for i in range(1, len(children)):
+                if children[i][0] == first_move:
+                    children.insert(0, children.pop(i))
+                    break
+        return children
+
+    def star_search(self, board, depth, is_maximizing, cumulative_prob, alpha, beta):
+        """
+        Expectimax với cửa sổ (alpha, beta) kiểu Star1 (Ballard).
+        Giá trị nằm trong (alpha, beta) là chính xác; <= alpha là cận trên, >= beta là cận dưới.
+        Cùng luật CUTOFF_THRESHOLD và cùng thứ tự cộng với expectimax() nên khi không cắt
+        nhánh nào thì kết quả trùng khớp.
+        """
+        self.nodes += 1
+        if self._deadline is not None and self.nodes % TIME_CHECK_INTERVAL == 0:
+            if time.perf_counter() > self._deadline:
+                raise _SearchTimeout()
+
+        if cumulative_prob < CUTOFF_THRESHOLD or depth == 0:
+            return self.evaluator.get_score(board), -1
+
+        # Bảng chuyển vị chỉ chứa giá trị chính xác
+        tt = self.tt
+        first_move = -1
+        if tt is not None:
+            if self.symmetry:
+                canon, sym = canonical(board)
+            else:
+                canon = board; sym = 0
+            key = (canon << 1) | (0 if is_maximizing else 1)
+            band = prob_band(cumulative_prob)
+            entry = tt.probe(key, depth, band)
+            if entry is not None:
+                return entry[0], FROM_CANONICAL[sym][entry[3]]
+            if is_maximizing:
+                first_move = FROM_CANONICAL[sym][tt.best_move(key)]
+
+        if is_maximizing:
+            children = self._max_children(board, first_move)
+            if not children:
+                best_score = self.evaluator.get_score(board)
+                if tt is not None:
+                    tt.store(key, best_score, depth, band)
+                return best_score, -1
+
+            best_score = -float('inf')
+            best_move = -1
+            a = alpha
+            for move, child, _ in children:
+                sc, _ = self.star_search(child, depth - 1, False, cumulative_prob, a, beta)
+                if sc > best_score:
+                    best_score = sc; best_move = move
+                    if sc > a: a = sc
+                    if sc >= beta: break
+
+            if tt is not None and alpha < best_score < beta:
+                tt.store(key, best_score, depth, band, TO_CANONICAL[sym][best_move])
+            return best_score, best_move
+
+        # Chance node: đã biết cận trên <= alpha từ lần fail-low trước -> cắt luôn
+        upper = self._upper_bounds.get((board, depth, cumulative_prob))
+        if upper is not None and upper <= alpha:
+            self.cutoffs += 1
+            return upper, -1
+
+        bits = empty_bits(board)
+        count = bits.bit_count()
+        if count == 0:
+            value = self.evaluator.get_score(board)
+            if tt is not None:
+                tt.store(key, value, depth, band)
+            return value, -1
+
+        prob_per_cell = 1.0 / count
+        new_prob_2 = cumulative_prob * prob_per_cell * 0.9
+        new_prob_4 = cumulative_prob * prob_per_cell * 0.1
+
+        # Các con (board, hệ số 0.9/0.1, xác suất) - con dưới ngưỡng CUTOFF đóng góp 0
+        children = []
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            if new_prob_2 >= CUTOFF_THRESHOLD:
+                children.append((board | bit, 0.9, new_prob_2))
+            if new_prob_4 >= CUTOFF_THRESHOLD:
+                children.append((board | (bit << 1), 0.1, new_prob_4))
+
+        # Làm việc trên tổng chưa chia: value = total / count
+        lo, hi = self._chance_bounds(board, depth)
+        bound_a = alpha * count
+        bound_b = beta * count
+        remaining = sum(c[1] for c in children)
+
+        total = 0.0
+        for child, factor, prob in children:
+            remaining -= factor
+            lower_remaining = remaining * lo
+
+            # Cửa sổ cho con: ngoài cửa sổ này thì Chance node chắc chắn ra ngoài (alpha, beta)
+            child_a = (bound_a - total - hi * remaining) / factor
+            child_b = (bound_b - total - lower_remaining) / factor
+            val, _ = self.star_search(child, depth - 1, True, prob, max(child_a, lo), min(child_b, hi))
+            total += val * factor
+
+            if val <= child_a:
+                self.cutoffs += 1
+                upper = (total + hi * remaining) / count
+                self._upper_bounds[(board, depth, cumulative_prob)] = upper
+                return upper, -1
+            if val >= child_b:
+                self.cutoffs += 1
+                return (total + lower_remaining) / count, -1
+
+        value = total / count
+        if tt is not None:
+            tt.store(key, value, depth, band)
+        return value, -1
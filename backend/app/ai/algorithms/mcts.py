@@ -1,36 +1,89 @@
+import math
 import random
-from .base import BaseSolver
+from collections import OrderedDict
+import numpy as np
+from .base import BaseSolver, _NIBBLE_LOW, empty_bits, popcount, nth_bit
+from .batch import move_batch_all
 
-# Bảng tìm ô trống (dùng chung)
-_EMPTY_TABLE = [[] for _ in range(65536)]
-for r in range(65536):
-    line = [(r >> (i*4)) & 0xF for i in range(4)]
-    _EMPTY_TABLE[r] = [i for i, val in enumerate(line) if val == 0]
+# --- UCT (mode="uct") ---
+UCT_EXPLORATION = 1.4   # Hằng số C của UCB1 (giá trị đã chuẩn hóa về [0, 1])
+PW_COEF = 1.0           # Progressive widening: Chance node đã thăm n lần
+PW_EXPONENT = 0.5       # được mở tối đa ceil(PW_COEF * n^PW_EXPONENT) kết quả sinh số
+
+# rollout_engine="auto": dưới ngưỡng này chi phí dựng mảng NumPy mỗi lần gọi lớn hơn phần
+# lợi (đo: ~0.3x ở 10 rollout, hòa ở ~40, ~2x ở 100 rollout mỗi hướng) -> dùng bản Python
+NUMPY_MIN_SIMULATIONS = 40
+
+# Cây của lần tìm trước (theo bộ tham số), để request /api/v1/move kế tiếp dùng lại
+MAX_CACHED_TREES = 8
+_TREE_CACHE = OrderedDict()
+
+_U4 = np.uint64(0xF)
+_SHIFTS_4 = np.arange(0, 64, 4, dtype=np.uint64)
+
+class _DecisionNode:
+    """Lượt AI: board sau khi đã sinh số"""
+    __slots__ = ("board", "children")
+
+    def __init__(self, board):
+        self.board = board
+        self.children = None  # move -> _ChanceNode (None = chưa mở rộng)
+
+class _ChanceNode:
+    """Lượt máy: board sau nước đi, con là các kết quả sinh số"""
+    __slots__ = ("board", "reward", "children", "visits", "value_sum")
+
+    def __init__(self, board, reward):
+        self.board = board
+        self.reward = reward   # Điểm gộp nhận được từ nước đi
+        self.children = {}     # board sau khi sinh số -> (xác suất, _DecisionNode)
+        self.visits = 0
+        self.value_sum = 0.0
 
 class MCTSSolver(BaseSolver):
-    def __init__(self, depth=3, weights=None):
-        super().__init__(depth, weights)
+    def __init__(self, depth=3, weights=None, mode="flat", iterations=None,
+                 exploration=UCT_EXPLORATION, reuse_tree=False, rollout_engine="python",
+                 eval_cache=None):
+        super().__init__(depth, weights, eval_cache)
         # Tăng số lượng mô phỏng lên vì Bitboard chạy nhanh
         self.simulations_per_move = 100 
         # Độ sâu mô phỏng (nhìn xa bao nhiêu bước trong tưởng tượng)
         self.simulation_depth = depth*2
 
+        # mode="flat": chia đều simulations_per_move cho mỗi hướng ở root (như cũ)
+        # mode="uct" : cây UCT có Chance node, mặc định cùng tổng số mô phỏng (100 x 4 hướng)
+        if mode not in ("flat", "uct"):
+            raise ValueError(f"Unknown MCTS mode: {mode}")
+        self.mode = mode
+        self.iterations = iterations if iterations is not None else self.simulations_per_move * 4
+        self.exploration = exploration
+        # reuse_tree: giữ lại cây con ứng với board thực tế ở nước tiếp theo
+        self.reuse_tree = reuse_tree
+        self._root = None
+        self._v_min = float('inf')
+        self._v_max = -float('inf')
+        self.reused_visits = 0
+
+        # rollout_engine="numpy": mode flat chạy mọi rollout của 1 hướng cùng lúc trên mảng uint64
+        # rollout_engine="auto": numpy khi simulations_per_move >= NUMPY_MIN_SIMULATIONS
+        if rollout_engine not in ("python", "numpy", "auto"):
+            raise ValueError(f"Unknown rollout_engine: {rollout_engine}")
+        self.rollout_engine = rollout_engine
+
     def get_best_move(self, grid):
         if isinstance(grid, int):
             board = grid
         else:
             board = self.grid_to_bitboard(grid)
 
+        if self.mode == "uct":
+            return self._uct_search(board)
+
         best_score = -float('inf')
         best_move = -1
         
-        # 1. Root Expansion: Thử 4 hướng đi đầu tiên
-        for direction in range(4):
-            new_board, score_gained, moved = self.simulate_move(board, direction)
-            
-            if not moved:
-                continue 
-
+        # 1. Root Expansion: Thử các hướng đi hợp lệ đầu tiên
+        for direction, new_board, score_gained in self.expand(board):
             # 2. Simulation: Chạy thử nghiệm từ trạng thái mới
             avg_score = self.run_simulations(new_board, score_gained)
             
@@ -41,77 +94,272 @@ class MCTSSolver(BaseSolver):
         return best_move
 
     def run_simulations(self, start_board, initial_score):
+        engine = self.rollout_engine
+        if engine == "numpy" or (engine == "auto" and self.simulations_per_move >= NUMPY_MIN_SIMULATIONS):
+            return self._run_simulations_numpy(start_board, initial_score)
+
         total_final_score = 0
         
         for _ in range(self.simulations_per_move):
-            current_board = start_board
-            current_score = initial_score
-            is_game_over = False
-
-            for _ in range(self.simulation_depth):
-                # --- A. ENEMY TURN (Sinh số ngẫu nhiên) ---
-                # 1. Tìm ô trống
-                cells = []
-                for idx in _EMPTY_TABLE[current_board & 0xFFFF]: cells.append(idx)
-                for idx in _EMPTY_TABLE[(current_board >> 16) & 0xFFFF]: cells.append(idx + 4)
-                for idx in _EMPTY_TABLE[(current_board >> 32) & 0xFFFF]: cells.append(idx + 8)
-                for idx in _EMPTY_TABLE[(current_board >> 48) & 0xFFFF]: cells.append(idx + 12)
-
-                if not cells: 
-                    is_game_over = True
-                    break 
-
-                idx = random.choice(cells)
-                val = 1 if random.random() < 0.9 else 2
-                current_board |= (val << (idx * 4))
-
-                # --- B. AI TURN (Greedy Walk - KHÔNG RANDOM HOÀN TOÀN) ---
-                # Thay vì random, ta thử cả 4 nước, nước nào ăn điểm (score_gained > 0) thì ưu tiên
-                
-                best_local_move = -1
-                best_local_score = -1
-                best_next_board = current_board
-                found_move = False
-
-                # Danh sách các nước đi hợp lệ
-                valid_moves = []
-
-                # Thử tất cả 4 hướng
-                for move in range(4):
-                    next_b, s, m = self.simulate_move(current_board, move)
-                    if m:
-                        valid_moves.append((move, s, next_b))
-                        # Ưu tiên nước đi gộp được nhiều điểm nhất
-                        if s > best_local_score:
-                            best_local_score = s
-                            best_local_move = move
-                            best_next_board = next_b
-
-                if not valid_moves:
-                    is_game_over = True
-                    break # Chết
-
-                # CHIẾN THUẬT ROLLOUT:
-                # 80% chọn nước đi ăn điểm nhiều nhất (Greedy)
-                # 20% chọn ngẫu nhiên trong các nước hợp lệ (để khám phá)
-                if best_local_move != -1 and random.random() < 0.8:
-                    current_board = best_next_board
-                    current_score += best_local_score
-                else:
-                    # Chọn ngẫu nhiên trong các nước đi được
-                    _, s, next_b = random.choice(valid_moves)
-                    current_board = next_b
-                    current_score += s
-
-            # --- C. ĐÁNH GIÁ CUỐI CÙNG ---
-            # Cộng điểm Heuristic Snake vào điểm tích lũy
-            # Điều này giúp MCTS biết hướng về đích là cấu trúc đẹp
-            final_heuristic = self.evaluator.get_score(current_board)
+            total_final_score += self._rollout(start_board, initial_score)
+
+        return total_final_score / self.simulations_per_move
+
+    def _rollout(self, start_board, initial_score):
+        """1 lần mô phỏng (greedy walk) từ start_board, trả về điểm cuối cùng"""
+        current_board = start_board
+        current_score = initial_score
+        is_game_over = False
+        moves = [0] * 4; boards = [0] * 4; scores = [0] * 4
+
+        for _ in range(self.simulation_depth):
+            # --- A. ENEMY TURN (Sinh số ngẫu nhiên) ---
+            # 1. Tìm ô trống: bit 4*i bật nếu ô i trống
+            x = current_board | (current_board >> 2)
+            x |= x >> 1
+            bits = (x & _NIBBLE_LOW) ^ _NIBBLE_LOW
+
+            if not bits: 
+                is_game_over = True
+                break 
+
+            # 2. Chọn bit bật thứ k (bit = tile 2 đặt vào ô đó)
+            for _ in range(random.randrange(bits.bit_count())):
+                bits &= bits - 1
+            bit = bits & -bits
+            current_board |= bit if random.random() < 0.9 else bit << 1
+
+            # --- B. AI TURN (Greedy Walk - KHÔNG RANDOM HOÀN TOÀN) ---
+            # Thay vì random, ta thử cả 4 nước, nước nào ăn điểm (score_gained > 0) thì ưu tiên
             
-            # Nếu game over sớm, phạt nặng
-            if is_game_over:
-                total_final_score += (current_score * 0.5) # Bị phạt
-            else:
-                total_final_score += (current_score + final_heuristic)
+            # Ghi các nước hợp lệ vào buffer dùng lại (không tạo tuple mỗi bước)
+            n = self.expand_into(current_board, moves, boards, scores)
+
+            if n == 0:
+                is_game_over = True
+                break # Chết
+
+            # Ưu tiên nước đi gộp được nhiều điểm nhất
+            best = 0
+            for i in range(1, n):
+                if scores[i] > scores[best]:
+                    best = i
+
+            # CHIẾN THUẬT ROLLOUT:
+            # 80% chọn nước đi ăn điểm nhiều nhất (Greedy)
+            # 20% chọn ngẫu nhiên trong các nước hợp lệ (để khám phá)
+            if random.random() >= 0.8:
+                # Chọn ngẫu nhiên trong các nước đi được
+                best = random.randrange(n)
+            current_board = boards[best]
+            current_score += scores[best]
+
+        # --- C. ĐÁNH GIÁ CUỐI CÙNG ---
+        # Nếu game over sớm, phạt nặng
+        if is_game_over:
+            return current_score * 0.5 # Bị phạt
+
+        # Cộng điểm Heuristic Snake vào điểm tích lũy
+        # Điều này giúp MCTS biết hướng về đích là cấu trúc đẹp
+        final_heuristic = self.evaluator.get_score(current_board)
+        return current_score + final_heuristic
+
+    def _run_simulations_numpy(self, start_board, initial_score):
+        """
+        Cùng chiến thuật rollout như _rollout() nhưng chạy lockstep: mỗi bước cập nhật
+        toàn bộ simulations_per_move board một lúc (tra bảng theo mảng, số ngẫu nhiên
+        rút trước cho cả bước). Rollout đã kết thúc được giữ nguyên tới cuối.
+        """
+        n = self.simulations_per_move
+        # Seed lấy từ random chuẩn để random.seed(...) của Benchmark vẫn tái lập được
+        rng = np.random.default_rng(random.getrandbits(64))
+
+        boards = np.full(n, start_board, dtype=np.uint64)
+        scores = np.full(n, initial_score, dtype=np.int64)
+        alive = np.ones(n, dtype=bool)
+        game_over = np.zeros(n, dtype=bool)
+        rows = np.arange(n)
+
+        for _ in range(self.simulation_depth):
+            draws = rng.random((4, n))
+
+            # --- A. ENEMY TURN: chọn ô trống thứ k (k = floor(u * số ô trống)) ---
+            empty = ((boards[:, None] >> _SHIFTS_4) & _U4) == 0
+            count = empty.sum(axis=1)
+            dead = alive & (count == 0)
+            game_over |= dead
+            alive &= ~dead
+            if not alive.any():
+                break
+
+            k = (draws[0] * count).astype(np.int64)
+            pos = np.argmax(np.cumsum(empty, axis=1) > k[:, None], axis=1).astype(np.uint64)
+            val = np.where(draws[1] < 0.9, 1, 2).astype(np.uint64)
+            boards = np.where(alive, boards | (val << (pos * np.uint64(4))), boards)
+
+            # --- B. AI TURN: tính cả 4 hướng cho mọi board ---
+            nexts, gains, valid = move_batch_all(boards)
+
+            dead = alive & ~valid.any(axis=1)
+            game_over |= dead
+            alive &= ~dead
+            if not alive.any():
+                break
+
+            # Greedy: hướng hợp lệ đầu tiên có điểm gộp cao nhất
+            greedy = np.argmax(np.where(valid, gains, -1), axis=1)
+            # Ngẫu nhiên: hướng hợp lệ thứ k
+            n_valid = valid.sum(axis=1)
+            k = (draws[3] * n_valid).astype(np.int64)
+            rand_move = np.argmax(np.cumsum(valid, axis=1) > k[:, None], axis=1)
+
+            move = np.where(draws[2] < 0.8, greedy, rand_move)
+            boards = np.where(alive, nexts[rows, move], boards)
+            scores = np.where(alive, scores + gains[rows, move], scores)
+
+        # --- C. ĐÁNH GIÁ CUỐI CÙNG (cả mảng một lần, xem Heuristics.get_score_batch) ---
+        final = np.where(game_over, scores * 0.5, scores + self.evaluator.get_score_batch(boards))
+        return float(final.sum()) / n
+
+    # --- UCT ---
+
+    def search_stats(self):
+        """Thống kê của lần tìm kiếm gần nhất (mode="uct")"""
+        root = self._root
+        visits = sum(c.visits for c in root.children.values()) if root is not None and root.children else 0
+        return {
+            "iterations": self.iterations,
+            "root_visits": visits,
+            # Số lượt mô phỏng có sẵn từ cây của nước trước
+            "reused_visits": self.reused_visits,
+        }
+
+    def _tree_key(self):
+        return (self.evaluator.fingerprint(), self.simulation_depth, self.exploration)
+
+    def _find_root(self, board):
+        """Tìm board trong cây cũ (root hoặc cháu của root sau nước đi + sinh số)"""
+        self.reused_visits = 0
+        if self.reuse_tree:
+            prev = self._root
+            if prev is None:
+                prev = _TREE_CACHE.get(self._tree_key())
+            if prev is not None:
+                if prev.board == board:
+                    found = prev
+                else:
+                    found = None
+                    for chance in (prev.children or {}).values():
+                        entry = chance.children.get(board)
+                        if entry is not None:
+                            found = entry[1]
+                            break
+                if found is not None and found.children:
+                    self.reused_visits = sum(c.visits for c in found.children.values())
+                    return found
+        return _DecisionNode(board)
+
+    def _uct_search(self, board):
+        root = self._find_root(board)
+        self._v_min = float('inf')
+        self._v_max = -float('inf')
+
+        for _ in range(self.iterations):
+            self._uct_iteration(root)
+
+        self._root = root
+        if self.reuse_tree:
+            key = self._tree_key()
+            _TREE_CACHE[key] = root
+            _TREE_CACHE.move_to_end(key)
+            if len(_TREE_CACHE) > MAX_CACHED_TREES:
+                _TREE_CACHE.popitem(last=False)
+
+        if not root.children:
+            return -1
+        # Nước được thăm nhiều nhất (robust child)
+        return max(root.children.items(), key=lambda mc: mc[1].visits)[0]
+
+    def _uct_iteration(self, root):
+        # 1. Selection / Expansion: đi xuống tới Chance node chưa thăm hoặc hết nước
+        node = root
+        path = []
+        while True:
+            if node.children is None:
+                self._expand(node)
+            if not node.children:
+                value = 0.0  # Hết nước đi (game over)
+                break
+            chance = self._select(node)
+            path.append(chance)
+            if chance.visits == 0:
+                # 2. Simulation từ afterstate của nước mới mở
+                value = self._rollout(chance.board, 0)
+                break
+            node = self._sample_outcome(chance)
+
+        # 3. Backpropagation: giá trị tại Chance node = điểm gộp của nước đi + phần sau đó
+        for chance in reversed(path):
+            value += chance.reward
+            chance.visits += 1
+            chance.value_sum += value
+            if value < self._v_min: self._v_min = value
+            if value > self._v_max: self._v_max = value
+
+    def _expand(self, node):
+        node.children = {}
+        for move, new_board, score_gained in self.expand(node.board):
+            node.children[move] = _ChanceNode(new_board, score_gained)
+
+    def _select(self, node):
+        """UCB1 trên giá trị trung bình đã chuẩn hóa; nước chưa thử được chọn trước"""
+        total = 0
+        for chance in node.children.values():
+            if chance.visits == 0:
+                return chance
+            total += chance.visits
+
+        log_total = math.log(total)
+        v_min = self._v_min
+        span = self._v_max - v_min
+        best = None
+        best_ucb = -float('inf')
+        for chance in node.children.values():
+            q = chance.value_sum / chance.visits
+            q = (q - v_min) / span if span > 0 else 0.5
+            ucb = q + self.exploration * math.sqrt(log_total / chance.visits)
+            if ucb > best_ucb:
+                best_ucb = ucb
+                best = chance
+        return best
+
+    def _sample_outcome(self, chance):
+        """
+        Sinh số theo đúng phân phối của game. Progressive widening: chỉ mở thêm kết quả mới
+        khi số con < ceil(PW_COEF * visits^PW_EXPONENT), ngược lại chọn lại trong các con
+        đã có theo xác suất sinh số của chúng.
+        """
+        board = chance.board
+        bits = empty_bits(board)
+        count = popcount(bits)
+
+        bit = nth_bit(bits, random.randrange(count))
+        val = 1 if random.random() < 0.9 else 2
+        child_board = board | (bit if val == 1 else bit << 1)
+
+        children = chance.children
+        entry = children.get(child_board)
+        if entry is not None:
+            return entry[1]
+
+        if len(children) < math.ceil(PW_COEF * chance.visits ** PW_EXPONENT):
+            node = _DecisionNode(child_board)
+            children[child_board] = ((0.9 if val == 1 else 0.1) / count, node)
+            return node
 
-        return total_final_score / self.simulations_per_move
\ No newline at end of file
+        r = random.random() * sum(p for p, _ in children.values())
+        for p, node in children.values():
+            r -= p
+            if r <= 0:
+                return node
+        return node
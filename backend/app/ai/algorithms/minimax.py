@@ -1,17 +1,38 @@
 import random
-from .base import BaseSolver, _ROW_LEFT_TABLE, _ROW_RIGHT_TABLE, _SCORE_TABLE
-
-_EMPTY_TABLE = [[] for _ in range(65536)]
-for r in range(65536):
-    line = [(r >> (i*4)) & 0xF for i in range(4)]
-    _EMPTY_TABLE[r] = [i for i, val in enumerate(line) if val == 0]
+from .base import BaseSolver, _ROW_LEFT_TABLE, _ROW_RIGHT_TABLE, _COL_UP_TABLE, _COL_DOWN_TABLE
+from .base import _NIBBLE_LOW, empty_bits
 
 class MinimaxSolver(BaseSolver):
+    def __init__(self, depth=3, weights=None, alpha_beta=True, eval_cache=None):
+        super().__init__(depth, weights, eval_cache)
+        # alpha_beta=False: minimax duyệt toàn bộ như cũ (để so sánh)
+        self.alpha_beta = alpha_beta
+        self.nodes = 0
+        self.cutoffs = 0
+        # History (Max node): điểm cộng cho hướng đi từng gây cắt nhánh, dùng chung giữa các node anh em
+        self.history = [0, 0, 0, 0]
+        # Killer (Min node): 2 ô sinh số gần nhất gây cắt nhánh ở mỗi độ sâu
+        self.killers = {}
+
     def get_best_move(self, grid):
+        self.nodes = 0
+        self.cutoffs = 0
+        self._start_eval_cache_stats()
+        if self.alpha_beta:
+            return self.alphabeta(grid, self.depth, True, -float('inf'), float('inf'))[1]
+
         # Bắt đầu đệ quy
         return self.minimax(grid, self.depth, True)[1]
 
+    def search_stats(self):
+        """Thống kê của lần tìm kiếm gần nhất"""
+        stats = {"nodes": self.nodes, "cutoffs": self.cutoffs, "depth": self.depth_reached}
+        if self.evaluator.cache is not None:
+            stats["eval_cache"] = self.eval_cache_stats()
+        return stats
+
     def minimax(self, board, depth, is_maximizing):
+        self.nodes += 1
         # Base Case
         if depth == 0:
             return self.evaluator.get_score(board), -1
@@ -44,27 +65,18 @@ class MinimaxSolver(BaseSolver):
             b1=a&0xFF00FF0000FF00FF; b2=a&0x00FF00FF00000000; b3=a&0x00000000FF00FF00
             tb=b1|(b2>>24)|(b3<<24)
 
-            # 2: UP (Move Left trên Transpose)
+            # 2: UP (bảng cột trên các hàng của Transpose)
             t_r0=tb&0xFFFF; t_r1=(tb>>16)&0xFFFF; t_r2=(tb>>32)&0xFFFF; t_r3=(tb>>48)&0xFFFF
-            ntb = (_ROW_LEFT_TABLE[t_r0] | (_ROW_LEFT_TABLE[t_r1]<<16) | (_ROW_LEFT_TABLE[t_r2]<<32) | (_ROW_LEFT_TABLE[t_r3]<<48))
-            if ntb != tb:
-                # Transpose ngược lại
-                a1=ntb&0xF0F00F0FF0F00F0F; a2=ntb&0x0000F0F00000F0F0; a3=ntb&0x0F0F00000F0F0000
-                a=a1|(a2<<12)|(a3>>12)
-                b1=a&0xFF00FF0000FF00FF; b2=a&0x00FF00FF00000000; b3=a&0x00000000FF00FF00
-                final_b=b1|(b2>>24)|(b3<<24)
+            final_b = (_COL_UP_TABLE[t_r0] | (_COL_UP_TABLE[t_r1]<<4) | (_COL_UP_TABLE[t_r2]<<8) | (_COL_UP_TABLE[t_r3]<<12))
+            if final_b != board:
                 
                 sc, _ = self.minimax(final_b, depth - 1, False)
                 if sc > best_score:
                     best_score = sc; best_move = 2
 
-            # 3: DOWN (Move Right trên Transpose)
-            ntb = (_ROW_RIGHT_TABLE[t_r0] | (_ROW_RIGHT_TABLE[t_r1]<<16) | (_ROW_RIGHT_TABLE[t_r2]<<32) | (_ROW_RIGHT_TABLE[t_r3]<<48))
-            if ntb != tb:
-                a1=ntb&0xF0F00F0FF0F00F0F; a2=ntb&0x0000F0F00000F0F0; a3=ntb&0x0F0F00000F0F0000
-                a=a1|(a2<<12)|(a3>>12)
-                b1=a&0xFF00FF0000FF00FF; b2=a&0x00FF00FF00000000; b3=a&0x00000000FF00FF00
-                final_b=b1|(b2>>24)|(b3<<24)
+            # 3: DOWN (bảng cột)
+            final_b = (_COL_DOWN_TABLE[t_r0] | (_COL_DOWN_TABLE[t_r1]<<4) | (_COL_DOWN_TABLE[t_r2]<<8) | (_COL_DOWN_TABLE[t_r3]<<12))
+            if final_b != board:
 
                 sc, _ = self.minimax(final_b, depth - 1, False)
                 if sc > best_score:
@@ -77,31 +89,110 @@ class MinimaxSolver(BaseSolver):
             return best_score, best_move
 
         else: # MIN Node
-            # FREE CELLS 
-            cells = []
-            
-            # Row 0
-            for idx in _EMPTY_TABLE[board & 0xFFFF]: cells.append(idx)
-            # Row 1 (Index + 4)
-            for idx in _EMPTY_TABLE[(board >> 16) & 0xFFFF]: cells.append(idx + 4)
-            # Row 2 (Index + 8)
-            for idx in _EMPTY_TABLE[(board >> 32) & 0xFFFF]: cells.append(idx + 8)
-            # Row 3 (Index + 12)
-            for idx in _EMPTY_TABLE[(board >> 48) & 0xFFFF]: cells.append(idx + 12)
-
-            if not cells:
+            # FREE CELLS: bit 4*i bật nếu ô i trống (bit thấp nhất = tile 2 đặt vào ô đó)
+            x = board | (board >> 2)
+            x |= x >> 1
+            bits = (x & _NIBBLE_LOW) ^ _NIBBLE_LOW
+
+            if not bits:
                 return self.evaluator.get_score(board), -1
 
             best_score = float('inf')
 
-            for idx in cells:
-                shift = idx * 4
+            while bits:
+                bit = bits & -bits
+                bits ^= bit
                 # Thử đặt 2
-                sc2, _ = self.minimax(board | (1 << shift), depth - 1, True)
+                sc2, _ = self.minimax(board | bit, depth - 1, True)
                 if sc2 < best_score: best_score = sc2
                 
                 # Thử đặt 4
-                sc4, _ = self.minimax(board | (2 << shift), depth - 1, True)
+                sc4, _ = self.minimax(board | (bit << 1), depth - 1, True)
                 if sc4 < best_score: best_score = sc4
             
-            return best_score, -1
\ No newline at end of file
+            return best_score, -1
+
+    def alphabeta(self, board, depth, is_maximizing, alpha, beta):
+        """
+        Minimax + cắt tỉa alpha-beta, cho cùng giá trị ở root như minimax().
+        - Max node: thử hướng có history cao trước, sau đó hướng gộp được nhiều điểm (_SCORE_TABLE).
+        - Min node: thử killer trước, sau đó ô sinh số "độc" nhất (điểm heuristic tĩnh thấp nhất).
+        """
+        self.nodes += 1
+        if depth == 0:
+            return self.evaluator.get_score(board), -1
+
+        if is_maximizing:
+            # (hướng, board mới, điểm gộp)
+            children = self.expand(board)
+
+            if not children:
+                return self.evaluator.get_score(board), -1
+
+            history = self.history
+            children.sort(key=lambda c: (history[c[0]], c[2]), reverse=True)
+
+            best_score = -float('inf')
+            best_move = -1
+            for move, nb, _ in children:
+                sc, _ = self.alphabeta(nb, depth - 1, False, alpha, beta)
+                if sc > best_score:
+                    best_score = sc; best_move = move
+                if sc > alpha: alpha = sc
+                if alpha >= beta:
+                    history[move] += depth * depth
+                    self.cutoffs += 1
+                    break
+            return best_score, best_move
+
+        else: # MIN Node
+            # Mỗi lần sinh số: key = tile đặt vào (bit << 0 là 2, bit << 1 là 4)
+            bits = empty_bits(board)
+
+            if not bits:
+                return self.evaluator.get_score(board), -1
+
+            evaluate = self.evaluator.get_score
+            best_score = float('inf')
+
+            # Con là lá: đánh giá trực tiếp, dừng ngay khi <= alpha
+            if depth == 1:
+                while bits:
+                    bit = bits & -bits
+                    bits ^= bit
+                    self.nodes += 1
+                    sc = evaluate(board | bit)
+                    if sc < best_score: best_score = sc
+                    if sc <= alpha:
+                        self.cutoffs += 1
+                        return best_score, -1
+                    self.nodes += 1
+                    sc = evaluate(board | (bit << 1))
+                    if sc < best_score: best_score = sc
+                    if sc <= alpha:
+                        self.cutoffs += 1
+                        return best_score, -1
+                return best_score, -1
+
+            # Sắp xếp: ô sinh số làm điểm tĩnh thấp nhất thử trước, killer lên đầu
+            killers = self.killers.get(depth, ())
+            children = []
+            while bits:
+                bit = bits & -bits
+                bits ^= bit
+                for key in (bit, bit << 1):
+                    child = board | key
+                    order = -float('inf') if key in killers else evaluate(child)
+                    children.append((order, key, child))
+            children.sort(key=lambda c: c[0])
+
+            for _, key, child in children:
+                sc, _ = self.alphabeta(child, depth - 1, True, alpha, beta)
+                if sc < best_score: best_score = sc
+                if sc < beta: beta = sc
+                if beta <= alpha:
+                    if key not in killers:
+                        self.killers[depth] = (key,) + tuple(killers[:1])
+                    self.cutoffs += 1
+                    break
+            return best_score, -1
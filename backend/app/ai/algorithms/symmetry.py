@@ -0,0 +1,82 @@
+from ..tables import load_tables
+
+# 8 phép đối xứng của bàn cờ 4x4 (nhóm dihedral D4), mã hóa bằng 3 bit:
+#   bit 2 (T): transpose (đổi hàng <-> cột), áp dụng trước
+#   bit 0 (H): lật trái-phải (đảo từng hàng)
+#   bit 1 (V): lật trên-dưới (đảo thứ tự hàng)
+# sym = 0 là giữ nguyên. Board chuẩn (canonical) = giá trị nhỏ nhất trong 8 biến thể.
+#
+# Khi đổi hệ tọa độ, hướng đi cũng đổi theo:
+#   H: LEFT <-> RIGHT, V: UP <-> DOWN, T: LEFT <-> UP, RIGHT <-> DOWN
+# Phần tử cuối (-1) để tra được cả move = -1 (không có nước đi).
+
+_REV = load_tables()['row_reverse'].tolist()
+
+_MAP_H = (1, 0, 2, 3)
+_MAP_V = (0, 1, 3, 2)
+_MAP_T = (2, 3, 0, 1)
+
+
+def _build_move_maps():
+    to_canon = []
+    from_canon = []
+    for sym in range(8):
+        fwd = []
+        for m in range(4):
+            # Board -> chuẩn: T, rồi H, rồi V
+            if sym & 4: m = _MAP_T[m]
+            if sym & 1: m = _MAP_H[m]
+            if sym & 2: m = _MAP_V[m]
+            fwd.append(m)
+        back = [0] * 4
+        for m in range(4):
+            back[fwd[m]] = m
+        to_canon.append(fwd + [-1])
+        from_canon.append(back + [-1])
+    return to_canon, from_canon
+
+# TO_CANONICAL[sym][move]: hướng trên board gốc -> hướng tương ứng trên board chuẩn
+# FROM_CANONICAL[sym][move]: ngược lại
+TO_CANONICAL, FROM_CANONICAL = _build_move_maps()
+
+
+def transform(board, sym):
+    """Áp dụng phép đối xứng sym lên board"""
+    if sym & 4:
+        board = _transpose(board)
+    r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+    if sym & 1:
+        r0 = _REV[r0]; r1 = _REV[r1]; r2 = _REV[r2]; r3 = _REV[r3]
+    if sym & 2:
+        r0, r1, r2, r3 = r3, r2, r1, r0
+    return r0 | (r1 << 16) | (r2 << 32) | (r3 << 48)
+
+
+def canonical(board):
+    """(board chuẩn, sym) với board chuẩn = transform(board, sym) nhỏ nhất trong 8 biến thể"""
+    best = board; sym = 0
+    for flip in (0, 4):
+        b = _transpose(board) if flip else board
+        r0 = b & 0xFFFF; r1 = (b >> 16) & 0xFFFF; r2 = (b >> 32) & 0xFFFF; r3 = (b >> 48) & 0xFFFF
+        h0 = _REV[r0]; h1 = _REV[r1]; h2 = _REV[r2]; h3 = _REV[r3]
+
+        if flip:
+            if b < best: best = b; sym = 4
+        x = h0 | (h1 << 16) | (h2 << 32) | (h3 << 48)
+        if x < best: best = x; sym = flip | 1
+        x = r3 | (r2 << 16) | (r1 << 32) | (r0 << 48)
+        if x < best: best = x; sym = flip | 2
+        x = h3 | (h2 << 16) | (h1 << 32) | (h0 << 48)
+        if x < best: best = x; sym = flip | 3
+    return best, sym
+
+
+def _transpose(x):
+    a1 = x & 0xF0F00F0FF0F00F0F
+    a2 = x & 0x0000F0F00000F0F0
+    a3 = x & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
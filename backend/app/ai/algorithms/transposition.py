@@ -0,0 +1,396 @@
+import math
+import struct
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+
+# Ngân sách bộ nhớ mặc định cho bảng chuyển vị (MB)
+DEFAULT_TT_MB = 32
+
+# Ước lượng bộ nhớ cho 1 entry trong dict Python
+# (slot dict + key int 64-bit + tuple 4 phần tử + float) ~ 184 byte đo bằng tracemalloc
+_BYTES_PER_ENTRY = 184
+
+# Cache dùng chung trong process (giữ lại giữa các request /api/v1/move)
+MAX_SHARED_TABLES = 8        # Số bộ (thuật toán, trọng số) giữ đồng thời
+SHARED_TABLE_TTL = 600       # Giây: bảng không dùng quá lâu sẽ bị bỏ
+_SHARED_TABLES = OrderedDict()
+
+
+def prob_band(cumulative_prob):
+    """
+    Dải xác suất của node: số mũ cơ số 2 (đảo dấu) của cumulative_prob.
+    1.0 -> -1, 0.5 -> 0, 0.25 -> 1 ... Band càng nhỏ => node được tìm càng kỹ
+    (CUTOFF_THRESHOLD cắt ít nhánh con hơn).
+    """
+    return -math.frexp(cumulative_prob)[1]
+
+
+class TranspositionTable:
+    """
+    Bảng chuyển vị cho cây Expectimax, key là bitboard 64-bit dịch trái 1 bit
+    kèm cờ loại node (0 = Max node, 1 = Chance node).
+
+    Mỗi entry là tuple (value, depth, band, move):
+      - depth: độ sâu còn lại đã tìm kiếm cho node này
+      - band : dải xác suất lúc tìm (xem prob_band)
+      - move : nước đi tốt nhất (Max node), -1 với Chance node
+    Entry chỉ được dùng lại khi nó được tìm ít nhất sâu và kỹ bằng yêu cầu.
+
+    Chính sách thay thế:
+      - Cùng key: giữ entry sâu/kỹ hơn (depth-preferred).
+      - Hết ngân sách: "lật thế hệ" - bảng hiện tại thành thế hệ trước, entry cũ hơn
+        bị bỏ. Entry nào ở thế hệ trước được probe lại sẽ được chép lên thế hệ mới
+        (xấp xỉ LRU mà không tốn chi phí cập nhật thứ tự mỗi lần truy cập).
+    """
+
+    def __init__(self, max_mb=DEFAULT_TT_MB, max_entries=None):
+        if max_entries is None:
+            max_entries = int(max_mb * 1024 * 1024 / _BYTES_PER_ENTRY)
+        self.max_entries = max(2, int(max_entries))
+        # Mỗi thế hệ giữ tối đa một nửa ngân sách
+        self._gen_limit = self.max_entries // 2
+
+        self._current = {}
+        self._previous = {}
+
+        # Bộ đếm thống kê
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        # Thời điểm dùng gần nhất (cho cache dùng chung)
+        self.last_used = time.time()
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def probe(self, key, depth, band):
+        """Trả về entry nếu dùng lại được, ngược lại None."""
+        entry = self._current.get(key)
+        if entry is None:
+            entry = self._previous.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            # Entry còn được dùng -> đưa lên thế hệ hiện tại
+            del self._previous[key]
+            self._insert(key, entry)
+
+        if entry[1] >= depth and entry[2] <= band:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    def best_move(self, key):
+        """Nước đi đã lưu cho key (bất kể độ sâu) - chỉ dùng để sắp thứ tự, không tính vào hit/miss"""
+        entry = self._current.get(key) or self._previous.get(key)
+        return entry[3] if entry is not None else -1
+
+    def store(self, key, value, depth, band, move=-1):
+        old = self._current.get(key)
+        if old is not None and old[1] >= depth and old[2] <= band:
+            # Entry cũ đã sâu/kỹ hơn, không ghi đè
+            return
+        self.stores += 1
+        self._insert(key, (value, depth, band, move))
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+    def _insert(self, key, entry):
+        current = self._current
+        if len(current) >= self._gen_limit and key not in current:
+            # Lật thế hệ: bỏ thế hệ cũ nhất
+            self.evictions += len(self._previous)
+            self._previous = current
+            current = self._current = {}
+        current[key] = entry
+
+
+# --- BẢNG CHUYỂN VỊ TRONG SHARED MEMORY ---
+# Slot 24 byte: check (u64), bit của value (u64), meta (u32), 4 byte đệm.
+# meta: bit 0 = đã dùng, bit 1 = bit 64 của key (cờ loại node), bit 2-4 = move + 1,
+#       bit 8-15 = depth, bit 16-23 = band + 128.
+# Ghi không khóa (kiểu Hyatt): check = key ^ value ^ meta. Hai tiến trình ghi đè cùng
+# slot có thể để lại slot lẫn lộn; khi đọc, key tính lại không khớp -> coi như miss.
+_SLOT = struct.Struct('<QQI4x')
+_F64 = struct.Struct('<d')
+_U64 = struct.Struct('<Q')
+_SLOT_DTYPE = np.dtype([('check', '<u8'), ('value', '<u8'), ('meta', '<u4'), ('pad', '<u4')])
+_MASK64 = (1 << 64) - 1
+_HASH_MUL = 0x9E3779B97F4A7C15
+# Số slot liên tiếp xét khi tìm / ghi (linear probing)
+SHM_PROBE_LIMIT = 4
+
+# SharedMemory đã attach trong process này (theo tên, xếp theo lần dùng gần nhất), dùng lại
+# khi unpickle nhiều lần. Worker sống theo process: cha xóa bảng (unlink) thì vùng nhớ chỉ
+# được trả lại khi mọi worker đóng mapping, nên mỗi worker chỉ giữ MAX_ATTACHED_TABLES bảng.
+MAX_ATTACHED_TABLES = 1
+_ATTACHED = OrderedDict()
+
+
+class SharedTranspositionTable:
+    """
+    Bảng chuyển vị kích thước cố định (open addressing) trong shared memory, cùng giao
+    diện với TranspositionTable. Pickle chỉ mang theo tên vùng nhớ: gửi bảng vào task của
+    Pool thì mọi worker đọc/ghi cùng 1 bảng.
+
+    Chính sách ghi: cùng key -> giữ entry sâu/kỹ hơn; slot trống -> ghi; hết chỗ trong
+    SHM_PROBE_LIMIT slot -> thay entry nông nhất (tính là collision).
+    Bộ đếm hits/misses/stores/collisions là của từng process: task chạy trong worker trả về
+    phần chênh lệch (counters_since) để process cha cộng vào bảng của mình (add_counters).
+    """
+
+    def __init__(self, max_mb=DEFAULT_TT_MB, max_entries=None):
+        if max_entries is None:
+            max_entries = int(max_mb * 1024 * 1024 / _SLOT.size)
+        # Số slot là lũy thừa của 2 (index = bit cao của hash)
+        bits = max(4, int(max_entries).bit_length() - 1)
+        self.max_entries = 1 << bits
+        self._shm = shared_memory.SharedMemory(create=True, size=self.max_entries * _SLOT.size)
+        self._owner = True
+        self._setup(bits)
+
+    def _setup(self, bits):
+        self._bits = bits
+        self._shift = 64 - bits
+        self._slot_mask = self.max_entries - 1
+        self._buf = self._shm.buf
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.collisions = 0
+        self.last_used = time.time()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "bits": self._bits}
+
+    def __setstate__(self, state):
+        name = state["name"]
+        shm = _ATTACHED.get(name)
+        if shm is None:
+            shm = _ATTACHED[name] = shared_memory.SharedMemory(name=name)
+        else:
+            _ATTACHED.move_to_end(name)
+        # Đóng các bảng task hiện tại không dùng (table cũ của chúng không còn được dùng:
+        # mỗi task tạo solver mới)
+        while len(_ATTACHED) > MAX_ATTACHED_TABLES:
+            _ATTACHED.popitem(last=False)[1].close()
+        self._shm = shm
+        self._owner = False
+        self.max_entries = 1 << state["bits"]
+        self._setup(state["bits"])
+
+    def _find(self, lo, hi):
+        """Offset của slot chứa key (lo, hi) và meta của nó, hoặc (-1, 0)"""
+        buf = self._buf
+        unpack = _SLOT.unpack_from
+        h = ((lo * _HASH_MUL) & _MASK64) >> self._shift
+        mask = self._slot_mask
+        for i in range(SHM_PROBE_LIMIT):
+            off = ((h + i) & mask) * 24
+            check, vbits, meta = unpack(buf, off)
+            if not meta & 1:
+                break
+            if check ^ vbits ^ meta == lo and (meta >> 1) & 1 == hi:
+                return off, meta
+        return -1, 0
+
+    def __len__(self):
+        slots = np.frombuffer(self._buf, dtype=_SLOT_DTYPE)
+        return int(np.count_nonzero(slots['meta'] & 1))
+
+    def probe(self, key, depth, band):
+        """Trả về entry (value, depth, band, move) nếu dùng lại được, ngược lại None."""
+        # Cùng vòng lặp với _find, viết inline vì probe nằm trong vòng lặp tìm kiếm
+        lo = key & _MASK64
+        hi = key >> 64
+        buf = self._buf
+        unpack = _SLOT.unpack_from
+        h = ((lo * _HASH_MUL) & _MASK64) >> self._shift
+        mask = self._slot_mask
+        for i in range(SHM_PROBE_LIMIT):
+            off = ((h + i) & mask) * 24
+            check, vbits, meta = unpack(buf, off)
+            if not meta & 1:
+                break
+            if check ^ vbits ^ meta == lo and (meta >> 1) & 1 == hi:
+                e_depth = (meta >> 8) & 0xFF
+                e_band = ((meta >> 16) & 0xFF) - 128
+                if e_depth >= depth and e_band <= band:
+                    self.hits += 1
+                    return (_F64.unpack_from(buf, off + 8)[0], e_depth, e_band, ((meta >> 2) & 7) - 1)
+                break
+        self.misses += 1
+        return None
+
+    def best_move(self, key):
+        """Nước đi đã lưu cho key (bất kể độ sâu) - chỉ dùng để sắp thứ tự, không tính vào hit/miss"""
+        off, meta = self._find(key & _MASK64, key >> 64)
+        return ((meta >> 2) & 7) - 1 if off >= 0 else -1
+
+    def store(self, key, value, depth, band, move=-1):
+        lo = key & _MASK64
+        hi = key >> 64
+        buf = self._buf
+        unpack = _SLOT.unpack_from
+        h = ((lo * _HASH_MUL) & _MASK64) >> self._shift
+        mask = self._slot_mask
+
+        target = -1
+        victim = -1
+        victim_depth = 256
+        for i in range(SHM_PROBE_LIMIT):
+            off = ((h + i) & mask) * 24
+            check, vbits, meta = unpack(buf, off)
+            if not meta & 1:
+                target = off
+                break
+            if check ^ vbits ^ meta == lo and (meta >> 1) & 1 == hi:
+                if (meta >> 8) & 0xFF >= depth and ((meta >> 16) & 0xFF) - 128 <= band:
+                    # Entry cũ đã sâu/kỹ hơn, không ghi đè
+                    return
+                target = off
+                break
+            if (meta >> 8) & 0xFF < victim_depth:
+                victim = off
+                victim_depth = (meta >> 8) & 0xFF
+        if target < 0:
+            target = victim
+            self.collisions += 1
+
+        vbits = _U64.unpack(_F64.pack(value))[0]
+        meta = (1 | (hi << 1) | ((move + 1) << 2) | (min(depth, 255) << 8) |
+                ((max(-128, min(band, 127)) + 128) << 16))
+        _SLOT.pack_into(buf, target, lo ^ vbits ^ meta, vbits, meta)
+        self.stores += 1
+
+    def clear(self):
+        np.frombuffer(self._buf, dtype=np.uint8)[:] = 0
+
+    def counters(self):
+        """(hits, misses, stores, collisions) của process này"""
+        return (self.hits, self.misses, self.stores, self.collisions)
+
+    def counters_since(self, before):
+        """Bộ đếm tăng thêm kể từ lúc lấy counters() = before"""
+        return tuple(now - then for now, then in zip(self.counters(), before))
+
+    def add_counters(self, counters):
+        """Cộng bộ đếm của process khác (phần chênh lệch gửi về từ worker)"""
+        hits, misses, stores, collisions = counters
+        self.hits += hits
+        self.misses += misses
+        self.stores += stores
+        self.collisions += collisions
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "stores": self.stores,
+            # Ghi đè entry của key khác do hết slot trống
+            "collisions": self.collisions,
+        }
+
+    def close(self):
+        """Đóng vùng nhớ; process tạo bảng thì xóa luôn vùng nhớ (unlink)"""
+        self._buf = None
+        if self._owner:
+            self._shm.close()
+            self._shm.unlink()
+        else:
+            _ATTACHED.pop(self._shm.name, None)
+            self._shm.close()
+
+
+def get_shared_table(namespace, max_mb=DEFAULT_TT_MB):
+    """
+    Lấy bảng chuyển vị dùng chung cho namespace (thuật toán, fingerprint trọng số).
+    Mỗi request /api/v1/move tạo solver mới, nhưng bảng này sống theo process nên
+    kết quả tìm kiếm ở nước N được dùng lại ở nước N+1.
+    Chính sách: LRU theo số bảng + hết hạn theo tuổi (SHARED_TABLE_TTL).
+    """
+    now = time.time()
+
+    # Bỏ các bảng quá hạn (OrderedDict xếp theo lần dùng gần nhất)
+    while _SHARED_TABLES:
+        oldest_key, oldest = next(iter(_SHARED_TABLES.items()))
+        if now - oldest.last_used <= SHARED_TABLE_TTL:
+            break
+        del _SHARED_TABLES[oldest_key]
+
+    table = _SHARED_TABLES.get(namespace)
+    if table is None:
+        table = TranspositionTable(max_mb)
+        _SHARED_TABLES[namespace] = table
+        if len(_SHARED_TABLES) > MAX_SHARED_TABLES:
+            _SHARED_TABLES.popitem(last=False)
+    else:
+        _SHARED_TABLES.move_to_end(namespace)
+
+    table.last_used = now
+    return table
+
+
+def clear_shared_tables():
+    _SHARED_TABLES.clear()
+
+
+# Bảng shared memory theo namespace cho tìm kiếm song song (process cha tạo, worker attach)
+_SHM_TABLES = {}
+
+
+def get_shared_memory_table(namespace, max_mb=DEFAULT_TT_MB):
+    """Như get_shared_table nhưng bảng nằm trong shared memory (giữ tối đa MAX_SHARED_TABLES bảng)"""
+    table = _SHM_TABLES.get(namespace)
+    if table is None:
+        if len(_SHM_TABLES) >= MAX_SHARED_TABLES:
+            oldest = min(_SHM_TABLES, key=lambda k: _SHM_TABLES[k].last_used)
+            _SHM_TABLES.pop(oldest).close()
+        table = _SHM_TABLES[namespace] = SharedTranspositionTable(max_mb)
+    table.last_used = time.time()
+    return table
+
+
+def adopt_inherited_tables():
+    """
+    Gọi trong worker vừa fork: các bảng cha tạo trước khi fork đã có sẵn mapping kế thừa,
+    chuyển chúng sang _ATTACHED để task dùng lại (không map lần 2 theo tên) và để worker
+    không bao giờ unlink bảng của cha.
+    """
+    for table in _SHM_TABLES.values():
+        _ATTACHED[table.name] = table._shm
+    _SHM_TABLES.clear()
+
+
+def close_shared_memory_tables():
+    for table in _SHM_TABLES.values():
+        table.close()
+    _SHM_TABLES.clear()
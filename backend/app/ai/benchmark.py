@@ -1,4 +1,3 @@
-import multiprocessing
 import time
 import random
 import statistics
@@ -10,7 +9,10 @@ from .algorithms.minimax import MinimaxSolver
 from .algorithms.mcts import MCTSSolver
 from .algorithms.dfs import DFSSolver
 from .algorithms.bfs import BFSSolver
-from .algorithms.base import BaseSolver  # Để dùng hàm helper nếu cần
+from .algorithms.base import BaseSolver, spawn_tile  # Để dùng hàm helper nếu cần
+from .heuristics import Heuristics
+from .algorithms.transposition import SharedTranspositionTable, DEFAULT_TT_MB
+from .pool import create_pool
 
 MAX_MOVES = 10000  # Tăng lên vì AI chơi bitboard rất nhanh
 
@@ -29,45 +31,146 @@ def get_max_tile(board):
 
 def spawn_random_tile(board):
     """Sinh ngẫu nhiên tile (2 hoặc 4) vào ô trống trên Bitboard"""
-    # 1. Tìm tất cả index ô trống (0-15)
-    empty_indices = []
-    temp = board
-    for i in range(16):
-        if (temp & 0xF) == 0:
-            empty_indices.append(i)
-        temp >>= 4
-    
-    if not empty_indices:
-        return board, False  # Full board, cannot spawn
+    # Mask ô trống bằng phép bit, chọn ô bằng bit thứ k (xem algorithms/base.py)
+    return spawn_tile(board, random)
 
-    # 2. Chọn ngẫu nhiên 1 ô
-    idx = random.choice(empty_indices)
-    
-    # 3. Chọn giá trị (90% ra 2, 10% ra 4)
-    # Power: 1 (2^1=2) hoặc 2 (2^2=4)
-    val_power = 1 if random.random() < 0.9 else 2
-    
-    # 4. Gán vào board bằng phép OR
-    # Dịch giá trị power đến đúng vị trí idx*4
-    new_board = board | (val_power << (idx * 4))
-    
-    return new_board, True
+def measure_move_speed(samples=50000, repeats=5, seed=0):
+    """
+    Micro-benchmark bộ sinh nước đi: số lần simulate_move mỗi giây cho từng hướng
+    (lấy lần chạy nhanh nhất trong repeats lần, board ngẫu nhiên tile <= 128).
+    """
+    rng = random.Random(seed)
+    boards = [rng.getrandbits(64) & 0x7777777777777777 for _ in range(samples)]
+    solver = ExpectimaxSolver(1, None)
+    move = solver.simulate_move
+
+    result = {}
+    for name, direction in (("left", 0), ("right", 1), ("up", 2), ("down", 3)):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for b in boards:
+                move(b, direction)
+            best = min(best, time.perf_counter() - start)
+        result[name] = int(samples / best)
+    return result
+
+# Bộ trọng số để kiểm tra cận: mặc định, đối xứng, từng thành phần riêng lẻ, trọng số âm
+BOUND_CHECK_WEIGHTS = (
+    None,
+    {'snake': 0},
+    {'snake': 1, 'monotonic': 0, 'smoothness': 0, 'free_tiles': 0, 'merges': 0},
+    {'snake': 0, 'monotonic': 1e6, 'smoothness': 0, 'free_tiles': 0, 'merges': 0},
+    {'snake': 0, 'monotonic': 0, 'smoothness': 1e6, 'free_tiles': 0, 'merges': 0},
+    {'snake': 0, 'monotonic': 0, 'smoothness': 0, 'free_tiles': 1e6, 'merges': 0},
+    {'snake': 0, 'monotonic': 0, 'smoothness': 0, 'free_tiles': 0, 'merges': 1e6},
+    {'snake': -1, 'monotonic': -1, 'smoothness': -2, 'free_tiles': -3, 'merges': -1},
+)
+
+def check_value_bounds(samples=2000, seed=0, weight_sets=BOUND_CHECK_WEIGHTS):
+    """
+    Kiểm tra Heuristics.value_bounds (Star1 chỉ đúng khi cận đúng): với board ngẫu
+    nhiên và từng bộ trọng số, L <= get_score(board) <= U với L, U = value_bounds(S, S).
+    Trả về danh sách (weights, board, L, score, U) vi phạm (rỗng = đúng).
+    """
+    rng = random.Random(seed)
+    # Kèm vài board khó: toàn tile 2 (merges lớn nhất), bàn cờ caro 2/8 (smooth nhỏ nhất)
+    boards = [0x1111111111111111, 0x3131131331311313]
+    for _ in range(samples):
+        top = rng.choice((3, 5, 7, 11, 15))
+        board = 0
+        for i in range(16):
+            if rng.random() < 0.7:
+                board |= rng.randint(1, top) << (4 * i)
+        boards.append(board)
+
+    violations = []
+    for weights in weight_sets:
+        h = Heuristics(weights)
+        for board in boards:
+            s = h.tile_sum(board)
+            lo, hi = h.value_bounds(s, s)
+            score = h.get_score(board)
+            # Sai số làm tròn float khi cộng các thành phần
+            eps = 1e-9 * max(abs(lo), abs(hi), 1.0)
+            if not (lo - eps <= score <= hi + eps):
+                violations.append((weights, board, lo, score, hi))
+    return violations
+
+def measure_eval_cache(moves=40, repeats=3, seed=0):
+    """
+    Micro-benchmark cache get_score (Heuristics(cache=...)): thời gian tìm nước đi cho
+    `moves` nước liên tiếp của 1 ván, tắt / bật cache, kèm hit rate.
+    Mỗi lần đo bắt đầu với cache rỗng (lấy lần nhanh nhất trong repeats lần).
+    """
+    # Các thế cờ của 1 ván Expectimax độ sâu 2
+    rng = random.Random(seed)
+    player = ExpectimaxSolver(2, None)
+    board = spawn_tile(spawn_tile(0, rng)[0], rng)[0]
+    boards = []
+    for _ in range(moves):
+        move = player.get_best_move(board)
+        if move == -1:
+            break
+        boards.append(board)
+        board = spawn_tile(player.simulate_move(board, move)[0], rng)[0]
+
+    configs = (
+        ("expectimax_d3", lambda c: ExpectimaxSolver(3, None, use_tt=False, eval_cache=c)),
+        ("expectimax_d3_tt", lambda c: ExpectimaxSolver(3, None, eval_cache=c)),
+        ("minimax_d4", lambda c: MinimaxSolver(4, None, eval_cache=c)),
+        ("dfs_d3", lambda c: DFSSolver(3, None, eval_cache=c)),
+        ("bfs_d3", lambda c: BFSSolver(3, None, eval_cache=c)),
+        ("mcts", lambda c: MCTSSolver(3, None, eval_cache=c)),
+    )
+    result = {}
+    for name, make in configs:
+        row = {}
+        for label, cache in (("off", None), ("on", True)):
+            best = float('inf')
+            for _ in range(repeats):
+                solver = make(cache)
+                since = None
+                if solver.evaluator.cache is not None:
+                    solver.evaluator.cache.clear()
+                    since = solver.evaluator.cache.counters()
+                random.seed(seed)
+                start = time.perf_counter()
+                for b in boards:
+                    solver.get_best_move(b)
+                best = min(best, time.perf_counter() - start)
+            row[label] = best
+            if cache:
+                row["hit_rate"] = solver.evaluator.cache.stats(since=since)["hit_rate"]
+        row["speedup"] = row["off"] / row["on"]
+        result[name] = row
+    return result
 
 def run_single_session(args):
     """Chạy 1 ván game trọn vẹn dùng Bitboard"""
-    algo_name, depth, weights = args
+    algo_name, depth, weights, options = args
+    # Tham số riêng của solver (vd: depth_policy="adaptive" cho Expectimax)
+    options = options or {}
     
     # Init Solver
     if algo_name == "Minimax (Classic)":
-        solver = MinimaxSolver(depth, weights)
+        solver = MinimaxSolver(depth, weights, **options)
     elif algo_name == "Expectimax (Default)":
-        solver = ExpectimaxSolver(depth, weights)
+        solver = ExpectimaxSolver(depth, weights, **options)
     elif algo_name == "Monte Carlo (MCTS)":
-        solver = MCTSSolver(depth, weights)
+        solver = MCTSSolver(depth, weights, **options)
+    elif algo_name == "Monte Carlo (UCT)":
+        solver = MCTSSolver(depth, weights, mode="uct", reuse_tree=True, **options)
     elif algo_name == "DFS (Greedy)":
-        solver = DFSSolver(depth, weights)
+        solver = DFSSolver(depth, weights, **options)
     else:
-        solver = BFSSolver(depth, weights)
+        solver = BFSSolver(depth, weights, **options)
+
+    # Bảng chuyển vị shared memory: bộ đếm là của worker này, gửi phần tăng thêm về cho cha
+    shared_tt = getattr(solver, "tt", None)
+    if not isinstance(shared_tt, SharedTranspositionTable):
+        shared_tt = None
+    tt_before = shared_tt.counters() if shared_tt is not None else None
 
     # Init Board (Số nguyên 0)
     board = 0
@@ -77,6 +180,7 @@ def run_single_session(args):
     board, _ = spawn_random_tile(board)
 
     moves = 0
+    depth_total = 0
     start_time = time.time()
     
     while moves < MAX_MOVES:
@@ -104,6 +208,8 @@ def run_single_session(args):
             break # Hết ô trống -> Game over
         
         moves += 1
+        # Chỉ tính độ sâu của các nước đã đi (lượt tìm cuối không ra nước đi thì bỏ)
+        depth_total += solver.depth_reached
 
     duration = time.time() - start_time
     
@@ -119,24 +225,46 @@ def run_single_session(args):
         "score": score,
         "max_tile": max_tile,
         "moves": moves,
-        "time": duration
+        "time": duration,
+        "avg_depth": depth_total / max(1, moves),
+        "tt_counters": shared_tt.counters_since(tt_before) if shared_tt is not None else None,
     }
 
 class BenchmarkRunner:
     @staticmethod
-    def run(algo_name, depth, weights, iterations=20):
+    def run(algo_name, depth, weights, iterations=20, options=None):
+        # options["shared_memory_tt"] = True (Expectimax): mọi ván dùng chung 1 bảng chuyển vị
+        # trong shared memory, các thế cờ đầu ván giống nhau chỉ phải tìm 1 lần
+        options = dict(options or {})
+        table = None
+        if options.pop("shared_memory_tt", False) and algo_name == "Expectimax (Default)":
+            table = SharedTranspositionTable(options.get("tt_mb", DEFAULT_TT_MB))
+            options["tt_table"] = table
+
         # Chuẩn bị tham số cho pool
-        tasks = [(algo_name, depth, weights)] * iterations
+        tasks = [(algo_name, depth, weights, options)] * iterations
         
-        # Sử dụng tất cả core CPU để chạy nhanh nhất
-        with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-            results = pool.map(run_single_session, tasks)
+        # Sử dụng tất cả core CPU để chạy nhanh nhất (worker dùng chung bảng tra cứu)
+        tt_stats = None
+        try:
+            with create_pool() as pool:
+                results = pool.map(run_single_session, tasks)
+            if table is not None:
+                # Cộng bộ đếm từ các worker (bảng ở cha không tự probe/store lần nào)
+                for r in results:
+                    if r['tt_counters'] is not None:
+                        table.add_counters(r['tt_counters'])
+                tt_stats = table.stats()
+        finally:
+            if table is not None:
+                table.close()
             
         # --- TỔNG HỢP THỐNG KÊ ---
         scores = [r['score'] for r in results]
         moves = [r['moves'] for r in results]
         times = [r['time'] for r in results]
         max_tiles = [r['max_tile'] for r in results]
+        depths = [r['avg_depth'] for r in results]
         
         # 1. Tile Distribution (Xác suất đạt tile)
         tile_counts = Counter(max_tiles)
@@ -162,10 +290,17 @@ class BenchmarkRunner:
             
             # Time
             "avg_time_per_game": statistics.mean(times),
+            "avg_time_per_move": sum(times) / max(1, sum(moves)),
             "total_duration": sum(times),
+
+            # Độ sâu tìm kiếm trung bình (khác depth khi solver tự chọn độ sâu)
+            "avg_depth": statistics.mean(depths),
             
             # Chi tiết phân bố
-            "tile_distribution": tile_dist
+            "tile_distribution": tile_dist,
+
+            # Bảng chuyển vị shared memory (options["shared_memory_tt"]), None nếu không dùng
+            "tt": tt_stats,
         }
         
         return stats
\ No newline at end of file
@@ -1,6 +1,7 @@
 import random
-import multiprocessing
 from .algorithms.expectimax import ExpectimaxSolver
+from .algorithms.base import spawn_tile
+from .pool import create_pool
 
 # Cấu hình training
 TRAINING_DEPTH = 3
@@ -11,26 +12,8 @@ def spawn_random_tile_bitboard(board):
     Sinh số ngẫu nhiên (2 hoặc 4) vào ô trống trên Bitboard.
     Trả về: (new_board, success)
     """
-    # 1. Tìm các index ô trống (0-15)
-    empty_indices = []
-    temp = board
-    for i in range(16):
-        if (temp & 0xF) == 0:
-            empty_indices.append(i)
-        temp >>= 4
-    
-    if not empty_indices:
-        return board, False
-
-    # 2. Chọn ngẫu nhiên vị trí
-    idx = random.choice(empty_indices)
-    
-    # 3. Chọn giá trị (90% ra 2 (bit=1), 10% ra 4 (bit=2))
-    val = 1 if random.random() < 0.9 else 2
-    
-    # 4. Gán vào board
-    new_board = board | (val << (idx * 4))
-    return new_board, True
+    # Mask ô trống bằng phép bit, chọn ô bằng bit thứ k (xem algorithms/base.py)
+    return spawn_tile(board, random)
 
 def play_game_simulation(weights):
     """
@@ -119,16 +102,23 @@ class GeneticAlgorithm:
         Chạy vòng lặp tiến hóa.
         """
         self.init_population()
+
+        # --- CHẠY SONG SONG (MULTIPROCESSING) ---
+        # 1 pool cho mọi thế hệ: worker chỉ khởi động và nạp bảng 1 lần
+        # Lưu ý: Trên Windows, hàm được map (play_game_simulation) phải nằm ở top-level
+        pool = create_pool()
+        try:
+            return self._evolve(pool, progress_callback)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _evolve(self, pool, progress_callback):
         best_solution = None
         best_fitness = -1
 
         for gen in range(self.generations):
-            scores = []
-            
-            # --- CHẠY SONG SONG (MULTIPROCESSING) ---
-            # Lưu ý: Trên Windows, hàm được map (play_game_simulation) phải nằm ở top-level
-            with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-                scores = pool.map(play_game_simulation, self.population)
+            scores = pool.map(play_game_simulation, self.population)
             
             # Tìm cá thể tốt nhất thế hệ này
             gen_best_idx = scores.index(max(scores))
@@ -1,169 +1,181 @@
 import math
+from collections import OrderedDict
+import numpy as np
+from .tables import load_tables, compact_list
+from .algorithms.batch import transpose_batch, _rows
 
-# --- 1. BẢNG CỐ ĐỊNH (SNAKE / GRADIENT) ---
-# Trọng số cực lớn, không đổi, dùng để định hình cấu trúc
-_TABLE_GRADIENT_0 = [0.0] * 65536
-_TABLE_GRADIENT_1 = [0.0] * 65536
-_TABLE_GRADIENT_2 = [0.0] * 65536
-_TABLE_GRADIENT_3 = [0.0] * 65536
-
-# --- 2. BẢNG TÙY CHỈNH (USER HEURISTICS) ---
-# Giá trị thô (Raw), sẽ nhân với trọng số người dùng khi chạy
-_TABLE_MERGES = [0.0] * 65536
-_TABLE_FREE   = [0.0] * 65536
-_TABLE_SMOOTH = [0.0] * 65536
-_TABLE_MONO_LEFT  = [0.0] * 65536
-_TABLE_MONO_RIGHT = [0.0] * 65536
+# --- 1. BẢNG MONOTONICITY (dùng chung mọi bộ trọng số) ---
+# Mỗi line 1 số nguyên gộp 2 giá trị không âm: (-mono_left) << 32 | (-mono_right).
+# Cộng 4 line vẫn giữ riêng 2 nửa (mỗi nửa < 2^21), nên 4 lần tra cho cả trái lẫn phải.
+_TABLE_MONO = [0] * 65536
+_MONO_LOW = 0xFFFFFFFF
+# Bản NumPy (int64, chưa gộp) của -mono_left / -mono_right cho get_score_batch
+_NP_MONO_LEFT = None
+_NP_MONO_RIGHT = None
+
+# Spawn-delta của monotonicity (cho expected_spawn_total): với mỗi line, xét mọi ô trống k
+# của line và tile sinh ra (2 hoặc 4), dl / dr = thay đổi của -mono_left / -mono_right.
+#   _TABLE_SPAWN_MONO: gộp như _TABLE_MONO, mỗi nửa = sum_k (9 * d(tile 2) + d(tile 4)) + _SPAWN_OFFSET
+#   _TABLE_SPAWN_EMAX / _EMIN: max / min của (dl - dr) trên mọi con (line đầy: -/+ _SPAWN_NONE)
+_TABLE_SPAWN_MONO = [0] * 65536
+_TABLE_SPAWN_EMAX = [0] * 65536
+_TABLE_SPAWN_EMIN = [0] * 65536
+_SPAWN_OFFSET = 1 << 28
+_SPAWN_NONE = 1 << 40
 
 # Cờ kiểm tra khởi tạo
 _TABLES_INITIALIZED = False
 
+# --- 2. EVALUATOR ĐÃ BIÊN DỊCH THEO BỘ TRỌNG SỐ ---
+# Trọng số cố định suốt 1 lần tìm kiếm -> gộp sẵn mọi thành phần cộng được thành
+# 4 bảng hàng (Snake khác nhau theo hàng) + 1 bảng cột. LRU theo fingerprint trọng số.
+MAX_COMPILED_EVALUATORS = 4
+_COMPILED = OrderedDict()
+
+# --- 3. CACHE KẾT QUẢ get_score (tùy chọn, Heuristics(cache=...)) ---
+# Mỗi bộ trọng số 1 cache, giữ lại giữa các lần tìm kiếm (LRU như evaluator đã biên dịch).
+# 1 entry (key int + float + slot dict) ~ 100 byte -> mặc định ~13MB mỗi bộ trọng số.
+DEFAULT_EVAL_CACHE_ENTRIES = 1 << 17
+_EVAL_CACHES = OrderedDict()
+
+# --- 4. CẬN GIÁ TRỊ (cho Star1 pruning) ---
+# Tính lười khi có solver cần tới (tốn ~0.5s)
+# _BOUND_STATS[name] = (min T, max T, min T[row]/sum(row), max T[row]/sum(row), T[0])
+# với sum(row) là tổng giá trị thật (2^k) các tile trong row
+_BOUND_STATS = None
+_TABLE_ROW_SUM = None
+
 class Heuristics:
-    def __init__(self, weights=None):
+    def __init__(self, weights=None, cache=None):
         # Cấu hình trọng số từ Frontend
         # Mặc định ta để các trọng số phụ này nhỏ để không phá vỡ Snake
         if weights:
-            self.w_mono   = weights.get('monotonic', 1.0)
-            self.w_smooth = weights.get('smoothness', 0.1)
-            self.w_free   = weights.get('free_tiles', 10.0)
-            self.w_merges = weights.get('merges', 1.0)
+            # float(): trọng số nguyên từ frontend (vd 50) phải cho cùng bảng / fingerprint với 50.0
+            self.w_mono   = float(weights.get('monotonic', 1.0))
+            self.w_smooth = float(weights.get('smoothness', 0.1))
+            self.w_free   = float(weights.get('free_tiles', 10.0))
+            self.w_merges = float(weights.get('merges', 1.0))
         else:
             self.w_mono   = 1.0
             self.w_smooth = 0.1
             self.w_free   = 10.0
             self.w_merges = 1.0
             
-        # Trọng số Snake cố định (Backbone) - Hệ số 1.0 vì bản thân bảng đã rất lớn
-        self.w_snake = 1.0 
+        # Trọng số Snake (Backbone) - Hệ số 1.0 vì bản thân bảng đã rất lớn
+        # weights['snake'] = 0 -> bỏ Snake, hàm đánh giá đối xứng (xem is_symmetric)
+        self.w_snake = float(weights.get('snake', 1.0)) if weights else 1.0
 
         global _TABLES_INITIALIZED
         if not _TABLES_INITIALIZED:
             self._init_tables()
             _TABLES_INITIALIZED = True
 
+        # get_score(board): hàm đã biên dịch cho bộ trọng số này (xem compiled_evaluator).
+        # Gán vào instance nên solver gọi thẳng hàm, không qua method.
+        # cache: None/False = tắt, True = DEFAULT_EVAL_CACHE_ENTRIES, số nguyên = số entry tối đa
+        compiled = compiled_evaluator(self.fingerprint())
+        evaluate = compiled.get_score
+        self.cache = None
+        if cache:
+            max_entries = DEFAULT_EVAL_CACHE_ENTRIES if cache is True else cache
+            self.cache = eval_cache(self.fingerprint(), evaluate, max_entries)
+            self.get_score = self.cache.get_score
+        else:
+            self.get_score = evaluate
+
+        # Đánh giá tăng dần theo line (không qua cache), xem _incremental_functions
+        self.line_contributions = compiled.line_contributions
+        self.update_score = compiled.update_score
+        self.spawn_score = compiled.spawn_score
+        # Kỳ vọng theo mọi ô trống của Chance node có con là lá (dùng bảng spawn-delta)
+        self.expected_spawn_total = compiled.expected_spawn_total
+        # get_score_batch(boards): get_score cho cả mảng bitboard (NumPy, không qua cache)
+        self.get_score_batch = compiled.get_score_batch
+
     def _init_tables(self):
         """
-        Khởi tạo TẤT CẢ các bảng trong 1 vòng lặp duy nhất để tối ưu khởi động.
+        Nạp bảng monotonicity gộp từ cache dùng chung (mmap, xem app/ai/tables.py).
+        Các bảng còn lại được gộp theo trọng số trong _compile.
         """
-        # Ma trận Snake (Cố định)
-        SNAKE_W = [
-            [65536, 32768, 16384, 8192], 
-            [512,   1024,  2048,  4096], 
-            [256,   128,   64,    32],   
-            [2,     4,     8,     16]    
-        ]
-
-        for row in range(65536):
-            # 1. Giải nén row 16-bit
-            line = [(row >> (i*4)) & 0xF for i in range(4)]
-            # Giá trị thực (2^k)
-            values = [(1 << p) if p > 0 else 0 for p in line]
-            
-            # --- A. TÍNH GRADIENT (SNAKE) ---
-            # Tính sẵn cho 4 vị trí hàng
-            for r_idx in range(4):
-                g_score = 0
-                for c_idx in range(4):
-                    g_score += values[c_idx] * SNAKE_W[r_idx][c_idx]
-                
-                if r_idx == 0: _TABLE_GRADIENT_0[row] = g_score
-                elif r_idx == 1: _TABLE_GRADIENT_1[row] = g_score
-                elif r_idx == 2: _TABLE_GRADIENT_2[row] = g_score
-                elif r_idx == 3: _TABLE_GRADIENT_3[row] = g_score
-
-            # --- B. TÍNH FREE TILES ---
-            _TABLE_FREE[row] = line.count(0)
-
-            # --- C. TÍNH SMOOTHNESS ---
-            smooth = 0
-            for i in range(3):
-                if values[i] != 0 and values[i+1] != 0:
-                    smooth -= abs(line[i] - line[i+1]) # Dùng log (line) hay value tùy bạn, ở đây dùng log cho nhẹ
-            _TABLE_SMOOTH[row] = smooth
-
-            # --- D. TÍNH MERGES (Logic của bạn) ---
-            merges = 0
-            prev = 0
-            counter = 0
-            for i in range(4):
-                rank = line[i]
-                if rank != 0:
-                    if prev == rank:
-                        counter += 1
-                    elif counter > 0:
-                        merges += 1 + counter
-                        counter = 0
-                    prev = rank
-            if counter > 0: merges += 1 + counter
-            _TABLE_MERGES[row] = merges
-
-            # --- E. TÍNH MONOTONICITY ---
-            mono_left = 0; mono_right = 0
-            for i in range(3):
-                curr = values[i]; nxt = values[i+1]
-                if curr > nxt: mono_left += (nxt - curr)
-                elif nxt > curr: mono_right += (curr - nxt)
-            _TABLE_MONO_LEFT[row] = mono_left
-            _TABLE_MONO_RIGHT[row] = mono_right
+        global _NP_MONO_LEFT, _NP_MONO_RIGHT
+        t = load_tables()
+        left = -t['mono_left'].astype(np.int64)
+        right = -t['mono_right'].astype(np.int64)
+        _TABLE_MONO[:] = compact_list((left << 32) | right)
+        _NP_MONO_LEFT = left
+        _NP_MONO_RIGHT = right
 
-    def get_score(self, board):
-        # 1. Tách hàng
-        r0 = board & 0xFFFF
-        r1 = (board >> 16) & 0xFFFF
-        r2 = (board >> 32) & 0xFFFF
-        r3 = (board >> 48) & 0xFFFF
-
-        # 2. Transpose lấy cột
-        a1 = board & 0xF0F00F0FF0F00F0F
-        a2 = board & 0x0000F0F00000F0F0
-        a3 = board & 0x0F0F00000F0F0000
-        a = a1 | (a2 << 12) | (a3 >> 12)
-        b1 = a & 0xFF00FF0000FF00FF
-        b2 = a & 0x00FF00FF00000000
-        b3 = a & 0x00000000FF00FF00
-        t_board = b1 | (b2 >> 24) | (b3 << 24)
-
-        c0 = t_board & 0xFFFF; c1 = (t_board >> 16) & 0xFFFF
-        c2 = (t_board >> 32) & 0xFFFF; c3 = (t_board >> 48) & 0xFFFF
-
-        # --- PHẦN 1: CORE SCORE (SNAKE) - Không nhân trọng số người dùng ---
-        snake_score = (_TABLE_GRADIENT_0[r0] + _TABLE_GRADIENT_1[r1] + 
-                       _TABLE_GRADIENT_2[r2] + _TABLE_GRADIENT_3[r3])
-
-        # --- PHẦN 2: USER HEURISTICS - Nhân trọng số người dùng ---
-        
-        # Free Tiles (Chỉ cần tính trên hàng)
-        raw_free = _TABLE_FREE[r0] + _TABLE_FREE[r1] + _TABLE_FREE[r2] + _TABLE_FREE[r3]
-        
-        # Merges (Hàng + Cột)
-        raw_merges = (_TABLE_MERGES[r0] + _TABLE_MERGES[r1] + _TABLE_MERGES[r2] + _TABLE_MERGES[r3] +
-                      _TABLE_MERGES[c0] + _TABLE_MERGES[c1] + _TABLE_MERGES[c2] + _TABLE_MERGES[c3])
-
-        # Smoothness (Hàng + Cột)
-        raw_smooth = (_TABLE_SMOOTH[r0] + _TABLE_SMOOTH[r1] + _TABLE_SMOOTH[r2] + _TABLE_SMOOTH[r3] +
-                      _TABLE_SMOOTH[c0] + _TABLE_SMOOTH[c1] + _TABLE_SMOOTH[c2] + _TABLE_SMOOTH[c3])
-
-        # Monotonicity
-        m_row = max(
-            _TABLE_MONO_LEFT[r0] + _TABLE_MONO_LEFT[r1] + _TABLE_MONO_LEFT[r2] + _TABLE_MONO_LEFT[r3],
-            _TABLE_MONO_RIGHT[r0] + _TABLE_MONO_RIGHT[r1] + _TABLE_MONO_RIGHT[r2] + _TABLE_MONO_RIGHT[r3]
-        )
-        m_col = max(
-            _TABLE_MONO_LEFT[c0] + _TABLE_MONO_LEFT[c1] + _TABLE_MONO_LEFT[c2] + _TABLE_MONO_LEFT[c3],
-            _TABLE_MONO_RIGHT[c0] + _TABLE_MONO_RIGHT[c1] + _TABLE_MONO_RIGHT[c2] + _TABLE_MONO_RIGHT[c3]
-        )
-        raw_mono = m_row + m_col
-
-        # TỔNG HỢP
-        # Snake đóng vai trò chính (vì giá trị bảng nó rất lớn: 65536...)
-        # Các chỉ số kia đóng vai trò phụ trợ (Tie-breaker)
-        total_score = (snake_score * self.w_snake + 
-                       raw_free * self.w_free + 
-                       raw_merges * self.w_merges + 
-                       raw_smooth * self.w_smooth + 
-                       raw_mono * self.w_mono)
-        
-        return total_score
+        spawn_left = _spawn_delta(left, 9, 1) + _SPAWN_OFFSET
+        spawn_right = _spawn_delta(right, 9, 1) + _SPAWN_OFFSET
+        _TABLE_SPAWN_MONO[:] = compact_list((spawn_left << 32) | spawn_right)
+
+        lines = np.arange(65536)
+        e_max = np.full(65536, -_SPAWN_NONE, dtype=np.int64)
+        e_min = np.full(65536, _SPAWN_NONE, dtype=np.int64)
+        for k in range(4):
+            empty = ((lines >> (4 * k)) & 0xF) == 0
+            for rank in (1, 2):
+                child = lines | (rank << (4 * k))
+                e = (left[child] - left) - (right[child] - right)
+                e_max = np.where(empty, np.maximum(e_max, e), e_max)
+                e_min = np.where(empty, np.minimum(e_min, e), e_min)
+        _TABLE_SPAWN_EMAX[:] = compact_list(e_max)
+        _TABLE_SPAWN_EMIN[:] = compact_list(e_min)
+
+    def tile_sum(self, board):
+        """Tổng giá trị các tile (bất biến khi đi, chỉ tăng 2/4 mỗi lần sinh số)"""
+        if _TABLE_ROW_SUM is None:
+            _init_bound_stats()
+        return (_TABLE_ROW_SUM[board & 0xFFFF] + _TABLE_ROW_SUM[(board >> 16) & 0xFFFF] +
+                _TABLE_ROW_SUM[(board >> 32) & 0xFFFF] + _TABLE_ROW_SUM[(board >> 48) & 0xFFFF])
+
+    def value_bounds(self, sum_lo, sum_hi):
+        """
+        Cận [L, U] của get_score cho mọi bàn cờ có tổng tile trong [sum_lo, sum_hi].
+        Mỗi thành phần lấy giao của cận tuyệt đối (min/max bảng x số line) và cận tỉ lệ
+        theo tổng tile (đúng với các bảng có T[0] == 0), sau đó nhân trọng số.
+        """
+        if _BOUND_STATS is None:
+            _init_bound_stats()
+        st = _BOUND_STATS
+
+        # Snake: mỗi hàng một bảng riêng
+        grads = [st['gradient_0'], st['gradient_1'], st['gradient_2'], st['gradient_3']]
+        ratio_lo = min(g[2] for g in grads)
+        ratio_hi = max(g[3] for g in grads)
+        snake_lo = max(sum(g[0] for g in grads), min(ratio_lo * sum_lo, ratio_lo * sum_hi))
+        snake_hi = min(sum(g[1] for g in grads), max(ratio_hi * sum_lo, ratio_hi * sum_hi))
+
+        free = _line_sum_bounds(st['free'], 4, sum_lo, sum_hi)
+        # Merges / smooth tính trên 4 hàng + 4 cột: mỗi tile được đếm 2 lần -> tổng line = 2S
+        merges = _line_sum_bounds(st['merges'], 8, 2 * sum_lo, 2 * sum_hi)
+        smooth = _line_sum_bounds(st['smooth'], 8, 2 * sum_lo, 2 * sum_hi)
+
+        # Mono = max(trái, phải) theo hàng + max(trái, phải) theo cột
+        left = _line_sum_bounds(st['mono_left'], 4, sum_lo, sum_hi)
+        right = _line_sum_bounds(st['mono_right'], 4, sum_lo, sum_hi)
+        mono = (2 * max(left[0], right[0]), 2 * max(left[1], right[1]))
+
+        lo = hi = 0.0
+        for (c_lo, c_hi), w in (((snake_lo, snake_hi), self.w_snake), (free, self.w_free),
+                                (merges, self.w_merges), (smooth, self.w_smooth), (mono, self.w_mono)):
+            if w >= 0:
+                lo += c_lo * w; hi += c_hi * w
+            else:
+                lo += c_hi * w; hi += c_lo * w
+        return lo, hi
+
+    def is_symmetric(self):
+        """
+        True nếu get_score bất biến qua 8 phép xoay/lật bàn cờ. Free/merges/smooth/mono
+        đều đối xứng (tính trên cả hàng lẫn cột, mono lấy max 2 chiều); chỉ Snake gắn
+        với 1 góc cố định.
+        """
+        return self.w_snake == 0
+
+    def fingerprint(self):
+        """Định danh bộ trọng số (dùng làm key cho các cache theo trọng số)"""
+        return (self.w_snake, self.w_mono, self.w_smooth, self.w_free, self.w_merges)
 
     # Hàm hỗ trợ cho Benchmark
     def get_empty_cells(self, grid):
@@ -175,4 +187,422 @@ class Heuristics:
                 temp >>= 4
             return cells
         else:
-            return [(r, c) for r in range(4) for c in range(4) if grid[r][c] == 0]
\ No newline at end of file
+            return [(r, c) for r in range(4) for c in range(4) if grid[r][c] == 0]
+
+
+def _line_sum_bounds(stat, n_lines, sum_lo, sum_hi):
+    """
+    Cận của tổng T[line] trên n_lines line, với [sum_lo, sum_hi] là khoảng của tổng giá trị
+    tile trên cả n_lines line đó (tile nằm trên nhiều line được tính nhiều lần)
+    """
+    t_lo, t_hi, r_lo, r_hi, t_zero = stat
+    lo = n_lines * t_lo
+    hi = n_lines * t_hi
+    if t_zero == 0:
+        lo = max(lo, min(r_lo * sum_lo, r_lo * sum_hi))
+        hi = min(hi, max(r_hi * sum_lo, r_hi * sum_hi))
+    return lo, hi
+
+
+def _init_bound_stats():
+    global _BOUND_STATS, _TABLE_ROW_SUM
+
+    t = load_tables()
+    row_sum = t['row_sum']
+
+    stats = {}
+    for name in ('gradient_0', 'gradient_1', 'gradient_2', 'gradient_3',
+                 'free', 'merges', 'smooth', 'mono_left', 'mono_right'):
+        table = t[name]
+        ratios = table[1:] / row_sum[1:]
+        stats[name] = (float(table.min()), float(table.max()),
+                       float(ratios.min()), float(ratios.max()), float(table[0]))
+
+    _TABLE_ROW_SUM = compact_list(row_sum)
+    _BOUND_STATS = stats
+
+
+def compiled_evaluator(fingerprint):
+    """
+    CompiledEvaluator cho bộ trọng số fingerprint (xem Heuristics.fingerprint).
+    Giữ tối đa MAX_COMPILED_EVALUATORS bộ gần nhất (LRU): API / Benchmark dùng lại
+    bộ trọng số của frontend giữa các request, GA mỗi cá thể 1 bộ.
+    """
+    compiled = _COMPILED.get(fingerprint)
+    if compiled is None:
+        compiled = _compile(*fingerprint)
+        _COMPILED[fingerprint] = compiled
+        if len(_COMPILED) > MAX_COMPILED_EVALUATORS:
+            _COMPILED.popitem(last=False)
+    else:
+        _COMPILED.move_to_end(fingerprint)
+    return compiled
+
+
+class EvalCache:
+    """
+    Cache board -> get_score cho 1 bộ trọng số.
+
+    Thay thế giống TranspositionTable: 2 thế hệ, mỗi thế hệ tối đa một nửa max_entries.
+    Thế hệ hiện tại đầy thì thành thế hệ trước, thế hệ trước cũ bị bỏ; entry ở thế hệ
+    trước được hỏi lại sẽ chép lên thế hệ hiện tại. Không phải cập nhật thứ tự khi hit.
+    """
+
+    def __init__(self, evaluate, max_entries=DEFAULT_EVAL_CACHE_ENTRIES):
+        self.evaluate = evaluate
+        self.resize(max_entries)
+        self._current = {}
+        self._previous = {}
+
+        # Bộ đếm thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def resize(self, max_entries):
+        self.max_entries = max(2, int(max_entries))
+        self._gen_limit = self.max_entries // 2
+
+    def get_score(self, board):
+        value = self._current.get(board)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        value = self._previous.get(board)
+        if value is None:
+            self.misses += 1
+            value = self.evaluate(board)
+        else:
+            self.hits += 1
+
+        current = self._current
+        if len(current) >= self._gen_limit:
+            # Lật thế hệ
+            self.evictions += len(self._previous)
+            self._previous = current
+            current = self._current = {}
+        current[board] = value
+        return value
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+    def counters(self):
+        """(hits, misses, evictions) tính từ lúc tạo cache (cộng dồn mọi solver dùng chung)"""
+        return (self.hits, self.misses, self.evictions)
+
+    def stats(self, since=None):
+        """
+        Thống kê cache. since = counters() lấy trước đó -> hits/misses/evictions chỉ tính
+        phần tăng thêm từ lúc ấy (vd 1 lần tìm kiếm), entries vẫn là kích thước hiện tại.
+        """
+        hits, misses, evictions = self.counters()
+        if since is not None:
+            hits -= since[0]; misses -= since[1]; evictions -= since[2]
+        lookups = hits + misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "evictions": evictions,
+        }
+
+
+def eval_cache(fingerprint, evaluate, max_entries=DEFAULT_EVAL_CACHE_ENTRIES):
+    """
+    EvalCache dùng chung cho bộ trọng số fingerprint (các solver / các nước đi liên tiếp
+    cùng trọng số dùng lại kết quả của nhau). Giữ tối đa MAX_COMPILED_EVALUATORS bộ (LRU).
+    """
+    cache = _EVAL_CACHES.get(fingerprint)
+    if cache is None:
+        cache = EvalCache(evaluate, max_entries)
+        _EVAL_CACHES[fingerprint] = cache
+        if len(_EVAL_CACHES) > MAX_COMPILED_EVALUATORS:
+            _EVAL_CACHES.popitem(last=False)
+    else:
+        _EVAL_CACHES.move_to_end(fingerprint)
+        if cache.max_entries != max_entries:
+            cache.resize(max_entries)
+    return cache
+
+
+class CompiledEvaluator:
+    """
+    Các hàm đánh giá của 1 bộ trọng số (xem _compile):
+      - get_score(board)
+      - line_contributions(board) -> contrib: đóng góp theo line của board
+      - update_score(contrib, cell, rank) -> (score, contrib) của board sau khi sinh
+        tile rank (1: tile 2, 2: tile 4) vào ô trống cell
+      - spawn_score(contrib, cell, rank) -> chỉ score (không tạo contrib mới)
+      - expected_spawn_total(board, bits, count) -> sum_ô (0.9 * score(tile 2) + 0.1 * score(tile 4))
+      - get_score_batch(boards) -> mảng float64, get_score của từng board
+    """
+
+    def __init__(self, get_score, line_contributions, update_score, spawn_score, expected_spawn_total,
+                 get_score_batch):
+        self.get_score = get_score
+        self.line_contributions = line_contributions
+        self.update_score = update_score
+        self.spawn_score = spawn_score
+        self.expected_spawn_total = expected_spawn_total
+        self.get_score_batch = get_score_batch
+
+
+def _compile(w_snake, w_mono, w_smooth, w_free, w_merges):
+    """
+    score = snake * w_snake + free * w_free + merges * w_merges + smooth * w_smooth + mono * w_mono
+      - hàng i: gradient_i * w_snake + (free * w_free + merges * w_merges + smooth * w_smooth)
+      - cột   : merges * w_merges + smooth * w_smooth (free đếm trên hàng là đủ)
+      - mono  : max(trái, phải) của hàng + của cột, không cộng dồn được nên tra _TABLE_MONO
+    Thành phần có trọng số 0 bị bỏ khi gộp; không cần cột thì không transpose.
+    """
+    t = load_tables()
+
+    # Bảng free / merges / smooth là int8: đổi sang float64 trước khi nhân trọng số
+    # (int8 * số nguyên Python vẫn là int8 -> tràn)
+    shared = np.zeros(65536)
+    if w_free: shared += t['free'].astype(np.float64) * w_free
+    if w_merges: shared += t['merges'].astype(np.float64) * w_merges
+    if w_smooth: shared += t['smooth'].astype(np.float64) * w_smooth
+
+    if w_snake:
+        row_values = [t[f'gradient_{i}'] * w_snake + shared for i in range(4)]
+    else:
+        row_values = [shared]
+
+    col_values = None
+    if w_merges or w_smooth:
+        col_values = np.zeros(65536)
+        if w_merges: col_values += t['merges'].astype(np.float64) * w_merges
+        if w_smooth: col_values += t['smooth'].astype(np.float64) * w_smooth
+    elif w_mono:
+        col_values = np.zeros(65536)
+
+    rows = [compact_list(v) for v in row_values]
+    # Spawn-delta theo bộ trọng số (phần cộng được), xem _expected_spawn_function
+    row_spawn = [compact_list(_spawn_delta(v, 0.9, 0.1)) for v in row_values]
+    if not w_snake:
+        # Không có Snake: 4 hàng dùng chung 1 bảng
+        rows *= 4
+        row_spawn *= 4
+
+    col = compact_list(col_values) if col_values is not None else None
+    line_contributions, update_score, spawn_score = _incremental_functions(rows, col, w_mono)
+    col_spawn = compact_list(_spawn_delta(col_values, 0.9, 0.1)) if col_values is not None else [0.0] * 65536
+    expected_spawn_total = _expected_spawn_function(rows, col, row_spawn, col_spawn, w_mono, line_contributions, spawn_score)
+
+    return CompiledEvaluator(_score_function(rows, col, w_mono), line_contributions, update_score, spawn_score,
+                             expected_spawn_total, _batch_function(row_values, col_values, w_mono))
+
+
+def _batch_function(row_values, col_values, w_mono):
+    """
+    get_score vector hóa: tách hàng / transpose cả mảng (xem algorithms/batch.py), tra bảng
+    bằng fancy indexing trên bản NumPy của các bảng đã gộp. Cộng theo đúng thứ tự của
+    get_score nên kết quả trùng với bản scalar.
+    """
+    np_rows = np.stack(row_values * 4 if len(row_values) == 1 else row_values)
+    line = np.arange(4)
+
+    def get_score_batch(boards):
+        boards = np.ascontiguousarray(boards, dtype=np.uint64).reshape(-1)
+        rows = _rows(boards).astype(np.intp)
+        values = np_rows[line, rows]
+        total = values[:, 0] + values[:, 1]
+        total += values[:, 2]
+        total += values[:, 3]
+        if col_values is None:
+            return total
+
+        cols = _rows(transpose_batch(boards)).astype(np.intp)
+        values = col_values[cols]
+        for i in range(4):
+            total += values[:, i]
+        if w_mono:
+            left = _NP_MONO_LEFT[rows].sum(axis=1); right = _NP_MONO_RIGHT[rows].sum(axis=1)
+            up = _NP_MONO_LEFT[cols].sum(axis=1); down = _NP_MONO_RIGHT[cols].sum(axis=1)
+            raw_mono = -(np.minimum(left, right) + np.minimum(up, down))
+            total += raw_mono * w_mono
+        return total
+    return get_score_batch
+
+
+def _spawn_delta(values, w2, w4):
+    """
+    Bảng 65536 dòng: với line x, sum trên các ô trống k của x của
+    w2 * (values[x + tile 2 ở k] - values[x]) + w4 * (values[x + tile 4 ở k] - values[x]).
+    """
+    lines = np.arange(65536)
+    total = np.zeros(65536, dtype=np.result_type(values, w2, w4))
+    for k in range(4):
+        empty = ((lines >> (4 * k)) & 0xF) == 0
+        delta = (w2 * (values[lines | (1 << (4 * k))] - values) +
+                 w4 * (values[lines | (2 << (4 * k))] - values))
+        total = total + np.where(empty, delta, 0)
+    return total
+
+
+def _score_function(rows, col, w_mono):
+    row0, row1, row2, row3 = rows
+    mono = _TABLE_MONO
+    low = _MONO_LOW
+
+    if col is None:
+        def get_score(board):
+            return (row0[board & 0xFFFF] + row1[(board >> 16) & 0xFFFF] +
+                    row2[(board >> 32) & 0xFFFF] + row3[(board >> 48) & 0xFFFF])
+        return get_score
+
+    if not w_mono:
+        def get_score(board):
+            a = (board & 0xF0F00F0FF0F00F0F) | ((board & 0x0000F0F00000F0F0) << 12) | ((board & 0x0F0F00000F0F0000) >> 12)
+            tb = (a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) | ((a & 0x00000000FF00FF00) << 24)
+            return (row0[board & 0xFFFF] + row1[(board >> 16) & 0xFFFF] +
+                    row2[(board >> 32) & 0xFFFF] + row3[(board >> 48) & 0xFFFF] +
+                    col[tb & 0xFFFF] + col[(tb >> 16) & 0xFFFF] + col[(tb >> 32) & 0xFFFF] + col[(tb >> 48) & 0xFFFF])
+        return get_score
+
+    def get_score(board):
+        r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+        a = (board & 0xF0F00F0FF0F00F0F) | ((board & 0x0000F0F00000F0F0) << 12) | ((board & 0x0F0F00000F0F0000) >> 12)
+        tb = (a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) | ((a & 0x00000000FF00FF00) << 24)
+        c0 = tb & 0xFFFF; c1 = (tb >> 16) & 0xFFFF; c2 = (tb >> 32) & 0xFFFF; c3 = (tb >> 48) & 0xFFFF
+
+        # max(trái, phải) = -min(-trái, -phải)
+        m = mono[r0] + mono[r1] + mono[r2] + mono[r3]
+        left = m >> 32; right = m & low
+        n = mono[c0] + mono[c1] + mono[c2] + mono[c3]
+        up = n >> 32; down = n & low
+        raw_mono = -((left if left < right else right) + (up if up < down else down))
+
+        return (row0[r0] + row1[r1] + row2[r2] + row3[r3] +
+                col[c0] + col[c1] + col[c2] + col[c3] + raw_mono * w_mono)
+    return get_score
+
+
+def _incremental_functions(rows, col, w_mono):
+    """
+    Đánh giá tăng dần. contrib = (board, tb, line_sum, mono_rows, mono_cols):
+      - board / tb: 4 hàng / 4 cột (board đã transpose) = chỉ số tra bảng của 8 line
+      - line_sum  : tổng đóng góp cộng được của 8 line (bảng hàng + bảng cột)
+      - mono_rows / mono_cols: tổng _TABLE_MONO của 4 hàng / 4 cột
+    Sinh 1 tile chỉ đổi 1 hàng + 1 cột: trừ đóng góp cũ, cộng đóng góp mới của 2 line đó
+    (8 lần tra thay vì 16 + transpose). Sai khác với get_score chỉ do thứ tự cộng float.
+    """
+    row0, row1, row2, row3 = rows
+    if col is None:
+        col = [0.0] * 65536
+    mono = _TABLE_MONO
+    low = _MONO_LOW
+
+    def line_contributions(board):
+        r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+        a = (board & 0xF0F00F0FF0F00F0F) | ((board & 0x0000F0F00000F0F0) << 12) | ((board & 0x0F0F00000F0F0000) >> 12)
+        tb = (a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) | ((a & 0x00000000FF00FF00) << 24)
+        c0 = tb & 0xFFFF; c1 = (tb >> 16) & 0xFFFF; c2 = (tb >> 32) & 0xFFFF; c3 = (tb >> 48) & 0xFFFF
+        return (board, tb,
+                row0[r0] + row1[r1] + row2[r2] + row3[r3] + col[c0] + col[c1] + col[c2] + col[c3],
+                mono[r0] + mono[r1] + mono[r2] + mono[r3], mono[c0] + mono[c1] + mono[c2] + mono[c3])
+
+    def spawn(contrib, cell, rank):
+        """(score, line_sum, mono hàng, mono cột) sau khi sinh: phần chung của 2 hàm dưới"""
+        board, tb, line_sum, m, n = contrib
+        r = cell >> 2; c = cell & 3
+        old_row = (board >> (r << 4)) & 0xFFFF; new_row = old_row | (rank << (c << 2))
+        old_col = (tb >> (c << 4)) & 0xFFFF; new_col = old_col | (rank << (r << 2))
+        table = rows[r]
+        line_sum += table[new_row] - table[old_row] + col[new_col] - col[old_col]
+        m += mono[new_row] - mono[old_row]
+        n += mono[new_col] - mono[old_col]
+        left = m >> 32; right = m & low
+        up = n >> 32; down = n & low
+        return line_sum - ((left if left < right else right) + (up if up < down else down)) * w_mono, line_sum, m, n
+
+    def spawn_score(contrib, cell, rank):
+        return spawn(contrib, cell, rank)[0]
+
+    def update_score(contrib, cell, rank):
+        score, line_sum, m, n = spawn(contrib, cell, rank)
+        r = cell >> 2; c = cell & 3
+        child = (contrib[0] | (rank << (cell << 2)), contrib[1] | (rank << ((c << 4) + (r << 2))), line_sum, m, n)
+        return score, child
+
+    return line_contributions, update_score, spawn_score
+
+
+def _expected_spawn_function(rows, col, row_spawn, col_spawn, w_mono, line_contributions, spawn_score):
+    """
+    Giá trị kỳ vọng (chưa chia count) của Chance node có mọi con là lá, không dựng con nào:
+      sum_ô (0.9 * S(tile 2) + 0.1 * S(tile 4)) = count * (tổng 8 line) + sum spawn-delta của 8 line
+    vì mỗi con chỉ đổi 1 hàng + 1 cột và phần cộng được của S là tổng theo line.
+    Monotonicity lấy min(trái, phải) nên chỉ tách theo line được khi mọi con chọn cùng 1 phía:
+    kiểm tra bằng _TABLE_SPAWN_EMAX / _EMIN, nếu không chắc thì tính từng con (spawn_score).
+    """
+    row0, row1, row2, row3 = rows
+    rs0, rs1, rs2, rs3 = row_spawn
+    if col is None:
+        col = [0.0] * 65536
+    mono = _TABLE_MONO
+    spawn_mono = _TABLE_SPAWN_MONO
+    e_max = _TABLE_SPAWN_EMAX
+    e_min = _TABLE_SPAWN_EMIN
+    low = _MONO_LOW
+    offset4 = 4 * _SPAWN_OFFSET
+
+    def per_child(board, bits):
+        contrib = line_contributions(board)
+        total_expect = 0
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            cell = bit.bit_length() >> 2
+            total_expect += spawn_score(contrib, cell, 1) * 0.9
+            total_expect += spawn_score(contrib, cell, 2) * 0.1
+        return total_expect
+
+    def expected_spawn_total(board, bits, count):
+        r0 = board & 0xFFFF; r1 = (board >> 16) & 0xFFFF; r2 = (board >> 32) & 0xFFFF; r3 = (board >> 48) & 0xFFFF
+        a = (board & 0xF0F00F0FF0F00F0F) | ((board & 0x0000F0F00000F0F0) << 12) | ((board & 0x0F0F00000F0F0000) >> 12)
+        tb = (a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) | ((a & 0x00000000FF00FF00) << 24)
+        c0 = tb & 0xFFFF; c1 = (tb >> 16) & 0xFFFF; c2 = (tb >> 32) & 0xFFFF; c3 = (tb >> 48) & 0xFFFF
+
+        total_expect = (count * (row0[r0] + row1[r1] + row2[r2] + row3[r3] + col[c0] + col[c1] + col[c2] + col[c3]) +
+                        rs0[r0] + rs1[r1] + rs2[r2] + rs3[r3] + col_spawn[c0] + col_spawn[c1] + col_spawn[c2] + col_spawn[c3])
+        if not w_mono:
+            return total_expect
+
+        # Hàng: phía nhỏ hơn (min) phải giữ nguyên ở mọi con
+        m = mono[r0] + mono[r1] + mono[r2] + mono[r3]
+        left = m >> 32; right = m & low
+        s = spawn_mono[r0] + spawn_mono[r1] + spawn_mono[r2] + spawn_mono[r3]
+        if left <= right:
+            if left - right + max(e_max[r0], e_max[r1], e_max[r2], e_max[r3]) > 0:
+                return per_child(board, bits)
+            row_mono = count * left + ((s >> 32) - offset4) * 0.1
+        else:
+            if left - right + min(e_min[r0], e_min[r1], e_min[r2], e_min[r3]) < 0:
+                return per_child(board, bits)
+            row_mono = count * right + ((s & low) - offset4) * 0.1
+
+        # Cột: tương tự
+        m = mono[c0] + mono[c1] + mono[c2] + mono[c3]
+        up = m >> 32; down = m & low
+        s = spawn_mono[c0] + spawn_mono[c1] + spawn_mono[c2] + spawn_mono[c3]
+        if up <= down:
+            if up - down + max(e_max[c0], e_max[c1], e_max[c2], e_max[c3]) > 0:
+                return per_child(board, bits)
+            col_mono = count * up + ((s >> 32) - offset4) * 0.1
+        else:
+            if up - down + min(e_min[c0], e_min[c1], e_min[c2], e_min[c3]) < 0:
+                return per_child(board, bits)
+            col_mono = count * down + ((s & low) - offset4) * 0.1
+
+        return total_expect - (row_mono + col_mono) * w_mono
+    return expected_spawn_total
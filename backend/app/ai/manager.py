@@ -6,16 +6,29 @@ from .algorithms.bfs import BFSSolver
 
 class AIManager:
     @staticmethod
-    def get_solver(algo_name, depth, weights):
+    def warm_up():
+        """Nạp sẵn các bảng tra cứu (mmap từ cache) để request đầu tiên không phải chờ"""
+        DFSSolver(1, None)
+
+    @staticmethod
+    def get_solver(algo_name, depth, weights, time_budget_ms=None, depth_policy="fixed", parallel=False):
         
         if algo_name == "Minimax (Classic)":
             return MinimaxSolver(depth, weights)
         
         elif algo_name == "Expectimax (Default)":
-            return ExpectimaxSolver(depth, weights)
+            # Giữ bảng chuyển vị giữa các request liên tiếp của cùng ván
+            # parallel: chia cây dưới root cho pool tiến trình (không dùng chung với time_budget_ms)
+            return ExpectimaxSolver(depth, weights, shared_tt=True, time_budget_ms=time_budget_ms,
+                                    depth_policy=depth_policy, parallel=parallel)
             
         elif algo_name == "Monte Carlo (MCTS)":
-            return MCTSSolver(depth, weights)
+            # Rollout lockstep trên mảng NumPy khi đủ nhiều rollout, cùng chiến thuật với bản Python
+            return MCTSSolver(depth, weights, rollout_engine="auto")
+
+        elif algo_name == "Monte Carlo (UCT)":
+            # Giữ cây con của board thực tế cho request kế tiếp
+            return MCTSSolver(depth, weights, mode="uct", reuse_tree=True)
             
         elif algo_name == "DFS (Greedy)":
             return DFSSolver(depth, weights)
@@ -24,4 +37,5 @@ class AIManager:
             return BFSSolver(depth, weights)
             
         else:
-            return ExpectimaxSolver(depth, weights)
\ No newline at end of file
+            return ExpectimaxSolver(depth, weights, shared_tt=True, time_budget_ms=time_budget_ms,
+                                    depth_policy=depth_policy)
\ No newline at end of file
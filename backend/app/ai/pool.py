@@ -0,0 +1,72 @@
+import gc
+import multiprocessing
+from multiprocessing import resource_tracker
+from .manager import AIManager
+from .algorithms.transposition import adopt_inherited_tables
+
+# Pool tiến trình cho Benchmark / GA dùng chung bảng tra cứu với tiến trình cha:
+#  - Bảng NumPy nằm trong file cache mmap (app/ai/tables.py): mọi tiến trình đọc
+#    cùng các trang trong page cache của OS, không ai giữ bản sao riêng.
+#  - fork: con kế thừa các list tra cứu đã nạp sẵn ở cha (copy-on-write). gc.freeze()
+#    ngay trước khi fork chuyển chúng sang thế hệ "vĩnh viễn" để GC ở con không ghi vào
+#    header các object bảng (ghi 1 byte là cả trang 4KB bị copy). Cha gc.unfreeze() ngay
+#    sau khi pool khởi động xong: server sống lâu, tạo pool mỗi request Benchmark / GA,
+#    nếu không rác vòng của cha tại thời điểm freeze sẽ không bao giờ được thu.
+#  - forkserver: server preload module warm (nạp bảng + gc.freeze), worker fork từ
+#    server nên cũng dùng chung như trường hợp fork.
+#  - spawn: không có tiến trình cha để chia sẻ list; initializer nạp bảng 1 lần lúc
+#    worker khởi động (từ mmap, không tính lại), trước khi nhận task đầu tiên.
+# Bảng chuyển vị shared memory (tìm kiếm song song): worker attach theo tên, đăng ký với
+# resource tracker. fork trước khi cha có tracker thì mỗi worker tự mở tracker riêng và
+# tracker đó unlink bảng của cha khi worker thoát -> cha khởi động tracker trước khi fork.
+
+
+def _init_worker():
+    AIManager.warm_up()
+    adopt_inherited_tables()
+
+
+def create_pool(processes=None):
+    """multiprocessing.Pool đã nạp sẵn bảng ở cha và ở từng worker"""
+    AIManager.warm_up()
+
+    ctx = multiprocessing.get_context()
+    method = ctx.get_start_method()
+    processes = processes or multiprocessing.cpu_count()
+    if method != "fork":
+        if method == "forkserver":
+            ctx.set_forkserver_preload([__package__ + ".warm"])
+        return ctx.Pool(processes=processes, initializer=_init_worker)
+
+    resource_tracker.ensure_running()
+    # Tắt GC trong lúc freeze + fork (GC chạy giữa chừng sẽ ghi vào các trang vừa freeze),
+    # worker giữ trạng thái đã freeze, cha trả lại như cũ khi mọi worker đã fork xong
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    gc.freeze()
+    try:
+        return ctx.Pool(processes=processes, initializer=_init_worker)
+    finally:
+        gc.unfreeze()
+        if gc_enabled:
+            gc.enable()
+
+
+# Pool cho tìm kiếm song song (ExpectimaxSolver(parallel=True)): tạo lần đầu cần dùng,
+# sống theo process để mỗi request /api/v1/move không phải khởi động lại worker.
+_SEARCH_POOL = None
+
+
+def get_search_pool():
+    global _SEARCH_POOL
+    if _SEARCH_POOL is None:
+        _SEARCH_POOL = create_pool()
+    return _SEARCH_POOL
+
+
+def close_search_pool():
+    global _SEARCH_POOL
+    if _SEARCH_POOL is not None:
+        _SEARCH_POOL.terminate()
+        _SEARCH_POOL.join()
+        _SEARCH_POOL = None
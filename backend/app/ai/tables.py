@@ -0,0 +1,182 @@
+import os
+import numpy as np
+
+# Tất cả bảng tra cứu 65536 dòng (1 dòng = 1 hàng 16-bit của bitboard) dùng chung
+# cho engine di chuyển (algorithms/base.py), heuristic (heuristics.py) và các solver.
+#
+# Lần chạy đầu tiên: sinh bằng NumPy (vector hóa) rồi lưu vào file .npy có phiên bản.
+# Các lần sau (mọi worker uvicorn / Pool): mở file bằng mmap, không phải tính lại.
+# Tăng TABLES_VERSION mỗi khi thay đổi cách tính bất kỳ bảng nào.
+TABLES_VERSION = 4
+
+# Thư mục cache, đổi được bằng biến môi trường AI_TABLES_CACHE_DIR
+CACHE_DIR = os.environ.get(
+    "AI_TABLES_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# Ma trận Snake (Cố định) - giống Heuristics
+SNAKE_W = [
+    [65536, 32768, 16384, 8192],
+    [512,   1024,  2048,  4096],
+    [256,   128,   64,    32],
+    [2,     4,     8,     16]
+]
+
+# Mỗi cột của structured array là 1 bảng, kiểu nhỏ nhất đủ chứa giá trị
+# (row_right cần 17 bit vì ô 32768+32768 tràn ra ngoài hàng)
+TABLE_DTYPE = np.dtype([
+    ('row_left', np.uint32), ('row_right', np.uint32), ('score', np.uint32),
+    ('col_up', np.uint64), ('col_down', np.uint64),
+    ('gradient_0', np.float64), ('gradient_1', np.float64),
+    ('gradient_2', np.float64), ('gradient_3', np.float64),
+    ('merges', np.int8), ('free', np.int8), ('smooth', np.int8),
+    ('mono_left', np.int32), ('mono_right', np.int32),
+    ('row_sum', np.int32), ('row_reverse', np.uint16),
+])
+
+_TABLES = None
+
+
+def cache_path():
+    return os.path.join(CACHE_DIR, f"lookup_tables_v{TABLES_VERSION}.npy")
+
+
+def load_tables():
+    """
+    Structured array 65536 dòng chứa mọi bảng (chỉ đọc).
+    Đọc bằng mmap nếu có file cache hợp lệ, ngược lại sinh mới và ghi cache.
+    """
+    global _TABLES
+    if _TABLES is not None:
+        return _TABLES
+
+    path = cache_path()
+    tables = None
+    if os.path.exists(path):
+        try:
+            tables = np.load(path, mmap_mode='r')
+            if tables.dtype != TABLE_DTYPE or tables.shape != (65536,):
+                tables = None
+        except (OSError, ValueError):
+            tables = None
+
+    if tables is None:
+        tables = build_tables()
+        _save(tables, path)
+
+    _TABLES = tables
+    return tables
+
+
+def compact_list(column):
+    """
+    List Python của 1 bảng (tra cứu nhanh nhất trong vòng lặp tìm kiếm), nhưng các giá
+    trị trùng nhau dùng chung 1 object: tốn 8 byte/dòng + số giá trị khác nhau,
+    thay vì 1 object int/float riêng cho mỗi dòng như tolist().
+    """
+    uniq, inverse = np.unique(column, return_inverse=True)
+    return list(map(uniq.tolist().__getitem__, inverse.tolist()))
+
+
+def _save(tables, path):
+    # Ghi ra file tạm rồi đổi tên để worker khác không đọc phải file ghi dở
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, tables)
+        os.replace(tmp, path)
+    except OSError:
+        # Thư mục chỉ đọc: dùng bảng trong bộ nhớ
+        pass
+
+
+def build_tables():
+    """Sinh toàn bộ bảng bằng NumPy (vector hóa theo 65536 row)"""
+    rows = np.arange(65536, dtype=np.int64)
+    line = np.stack([(rows >> (4 * i)) & 0xF for i in range(4)], axis=1)
+    values = np.where(line > 0, 1 << line, 0)
+
+    t = np.zeros(65536, dtype=TABLE_DTYPE)
+
+    # --- MOVE LEFT / RIGHT ---
+    left, score = _slide_left(line)
+    right, _ = _slide_left(line[:, ::-1])
+    right = right[:, ::-1]
+    t['row_left'] = _pack(left)
+    t['row_right'] = _pack(right)
+    t['score'] = score
+
+    # Bảng cột: nibble i của hàng kết quả đặt ở bit 16*i
+    t['col_up'] = _spread(t['row_left'])
+    t['col_down'] = _spread(t['row_right'])
+
+    # --- HEURISTICS ---
+    for r_idx in range(4):
+        t[f'gradient_{r_idx}'] = values @ np.array(SNAKE_W[r_idx], dtype=np.int64)
+
+    t['free'] = (line == 0).sum(axis=1)
+
+    both = (line[:, :-1] != 0) & (line[:, 1:] != 0)
+    t['smooth'] = -np.where(both, np.abs(line[:, :-1] - line[:, 1:]), 0).sum(axis=1)
+
+    merges = np.zeros(65536, dtype=np.int64)
+    prev = np.zeros(65536, dtype=np.int64)
+    counter = np.zeros(65536, dtype=np.int64)
+    for i in range(4):
+        rank = line[:, i]
+        nz = rank != 0
+        same = nz & (prev == rank)
+        flush = nz & ~same & (counter > 0)
+        merges += np.where(flush, 1 + counter, 0)
+        counter = np.where(same, counter + 1, np.where(flush, 0, counter))
+        prev = np.where(nz, rank, prev)
+    merges += np.where(counter > 0, 1 + counter, 0)
+    t['merges'] = merges
+
+    curr = values[:, :-1]; nxt = values[:, 1:]
+    t['mono_left'] = np.where(curr > nxt, nxt - curr, 0).sum(axis=1)
+    t['mono_right'] = np.where(nxt > curr, curr - nxt, 0).sum(axis=1)
+
+    # --- PHỤ TRỢ ---
+    t['row_sum'] = values.sum(axis=1)
+    # Đảo thứ tự 4 ô trong row (lật trái-phải)
+    t['row_reverse'] = _pack(line[:, ::-1])
+    return t
+
+
+def _slide_left(line):
+    """Dồn + gộp sang trái cho mọi row: trả về (line mới, điểm gộp)"""
+    n = line.shape[0]
+    # Dồn các ô khác 0 về đầu (giữ thứ tự)
+    order = np.argsort(line == 0, axis=1, kind='stable')
+    packed = np.take_along_axis(line, order, axis=1)
+    packed = np.concatenate([packed, np.zeros((n, 1), dtype=line.dtype)], axis=1)
+
+    out = np.zeros((n, 4), dtype=np.int64)
+    score = np.zeros(n, dtype=np.int64)
+    write = np.zeros(n, dtype=np.int64)
+    skip = np.zeros(n, dtype=bool)
+    idx = np.arange(n)
+    for i in range(4):
+        cur = packed[:, i]
+        active = (cur != 0) & ~skip
+        merge = active & (cur == packed[:, i + 1])
+        val = np.where(merge, cur + 1, cur)
+        out[idx[active], write[active]] = val[active]
+        score += np.where(merge, 1 << (cur + 1), 0)
+        write += active
+        skip = merge
+    return out, score
+
+
+def _pack(line):
+    # OR (không cộng) để giữ đúng cách bảng gốc xử lý ô 2^16 tràn sang nibble kế bên
+    return line[:, 0] | (line[:, 1] << 4) | (line[:, 2] << 8) | (line[:, 3] << 12)
+
+
+def _spread(row):
+    row = row.astype(np.uint64)
+    m = np.uint64(0xF)
+    return ((row & m) | (((row >> np.uint64(4)) & m) << np.uint64(16)) |
+            (((row >> np.uint64(8)) & m) << np.uint64(32)) | (((row >> np.uint64(12)) & m) << np.uint64(48)))
@@ -0,0 +1,8 @@
+# Import module này = nạp sẵn mọi bảng tra cứu.
+# Dùng làm preload cho forkserver (xem pool.py): server nạp 1 lần, các worker fork
+# từ server nên dùng chung bảng (copy-on-write) thay vì tự nạp.
+import gc
+from .manager import AIManager
+
+AIManager.warm_up()
+gc.freeze()
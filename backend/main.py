@@ -10,6 +10,8 @@ from typing import Optional, List, Dict
 from app.ai.manager import AIManager
 from app.ai.genetic import GeneticAlgorithm
 from app.ai.benchmark import BenchmarkRunner
+from app.ai.pool import close_search_pool
+from app.ai.algorithms.transposition import close_shared_memory_tables
 
 app = FastAPI()
 
@@ -21,6 +23,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def warm_up_tables():
+    # Mỗi worker nạp bảng tra cứu 1 lần lúc khởi động
+    AIManager.warm_up()
+
+@app.on_event("shutdown")
+def stop_search_pool():
+    # Dừng pool của tìm kiếm song song (nếu đã tạo) và xóa các bảng shared memory của nó
+    close_search_pool()
+    close_shared_memory_tables()
+
 class GARequest(BaseModel):
     population_size: int = 10
     mutation_rate: float = 0.1
@@ -31,12 +44,20 @@ class GameState(BaseModel):
     depth: int = 3
     algorithm: str = "Expectimax (Default)"
     weights: Optional[Dict[str, float]] = None
+    # Nếu có: Expectimax đào sâu dần trong giới hạn thời gian này (bỏ qua depth)
+    time_budget_ms: Optional[int] = None
+    # "fixed" hoặc "adaptive" (Expectimax tự chọn độ sâu theo độ phức tạp bàn cờ)
+    depth_policy: str = "fixed"
+    # Expectimax chia cây cho pool tiến trình (dùng mọi core), không dùng cùng time_budget_ms
+    parallel: bool = False
 
 class BenchmarkRequest(BaseModel):
     algorithm: str
     depth: int
     weights: Dict[str, float]
     iterations: int = 10
+    # Tham số riêng của solver, vd: {"depth_policy": "adaptive", "max_depth": 6}
+    options: Optional[Dict] = None
 
 # Chuyển từ grid 2 chiều sang bitboard
 def grid_to_bitboard(grid):
@@ -65,8 +86,10 @@ async def get_move(state: GameState):
     
     final_move = -1
     try:
-        solver = AIManager.get_solver(state.algorithm, state.depth, state.weights)
+        solver = AIManager.get_solver(state.algorithm, state.depth, state.weights,
+                                      state.time_budget_ms, state.depth_policy, state.parallel)
         final_move = solver.get_best_move(grid_to_bitboard(state.board))
+        depth_reached = solver.depth_reached
     except Exception as e:
         print(e)
         return {"move": -1, "error": str(e)}
@@ -79,9 +102,9 @@ async def get_move(state: GameState):
         w = state.weights
         print(f"Weights: Mono={w.get('monotonic'):.1f} | Smth={w.get('smoothness'):.1f} | Free={w.get('free_tiles'):.1f} | Max={w.get('merges'):.1f}")
 
-    print(f"[{state.algorithm[:15]:<15}] Move: {move_str} | {duration:6.2f}ms")
+    print(f"[{state.algorithm[:15]:<15}] Move: {move_str} | Depth: {depth_reached} | {duration:6.2f}ms")
 
-    return {"move": final_move, "engine": "Python"}
+    return {"move": final_move, "engine": "Python", "depth": depth_reached}
 
 @app.post("/api/v1/ga/train")
 async def run_ga_training(config: GARequest):
@@ -116,7 +139,8 @@ async def run_benchmark(req: BenchmarkRequest):
             algo_name=req.algorithm,
             depth=req.depth,
             weights=req.weights,
-            iterations=req.iterations
+            iterations=req.iterations,
+            options=req.options
         )
         return stats
     except Exception as e: